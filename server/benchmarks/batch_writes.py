@@ -0,0 +1,89 @@
+"""Per-item writes versus the batch endpoints.
+
+Imports N experiences and N study files once through the per-item routes
+(POST /experiences, POST /studyfiles) and once through the batch routes
+(POST /experiences/bulk, POST /studyfiles/batch), in-process:
+
+    python benchmarks/batch_writes.py --items 20 100 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='lessin-batch-'), 'batch.db')}"
+os.environ.setdefault("EXTRACT_WORKERS", "0")
+os.chdir(SERVER_DIR)
+sys.path.insert(0, SERVER_DIR)
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+
+PDF_BYTES = 256 * 1024
+
+
+async def timed(coro) -> float:
+    t0 = time.perf_counter()
+    await coro
+    return (time.perf_counter() - t0) * 1000
+
+
+async def run(args):
+    await main.on_startup()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        user_id = (await client.post("/signup", data={"username": "bench", "email": "e", "password": "p"})).json()["id"]
+        set_id = (await client.post("/studysets", data={"user_id": user_id, "title": "bench"})).json()["id"]
+        experience = {"title": "Engineer", "company": "Lessin", "location": "Remote", "start_date": "2024-01-01"}
+
+        async def experiences_per_item(n):
+            for _ in range(n):
+                (await client.post("/experiences", data={"user_id": user_id, **experience, "bullets_json": '["a", "b"]'})).raise_for_status()
+
+        async def experiences_bulk(n):
+            ops = [{"op": "create", "data": {**experience, "bullets": ["a", "b"]}} for _ in range(n)]
+            (await client.post("/experiences/bulk", json={"user_id": user_id, "operations": ops})).raise_for_status()
+
+        def pdf(i):
+            # distinct content per file so deduplication does not skip writes
+            return (f"file-{i}.pdf", os.urandom(PDF_BYTES), "application/pdf")
+
+        created_urls = []
+
+        async def files_per_item(n):
+            for i in range(n):
+                r = await client.post("/studyfiles", data={"study_set_id": set_id}, files={"file": pdf(i)})
+                r.raise_for_status()
+                created_urls.append(r.json()["file_url"])
+
+        async def files_batch(n):
+            files = [("files", pdf(i)) for i in range(n)]
+            r = await client.post("/studyfiles/batch", data={"study_set_id": set_id}, files=files)
+            r.raise_for_status()
+            created_urls.extend(f["file_url"] for f in r.json())
+
+        print(f"{'items':>6} {'exp per-item ms':>16} {'exp bulk ms':>12} {'files per-item ms':>18} {'files batch ms':>15}")
+        for n in args.items:
+            row = [
+                await timed(experiences_per_item(n)),
+                await timed(experiences_bulk(n)),
+                await timed(files_per_item(min(n, args.max_files))),
+                await timed(files_batch(min(n, args.max_files))),
+            ]
+            print(f"{n:>6} {row[0]:>16.1f} {row[1]:>12.1f} {row[2]:>18.1f} {row[3]:>15.1f}")
+
+    # benchmark blobs are random, so nothing else references them
+    for url in created_urls:
+        os.remove(main.upload_path(url))
+    await main.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, nargs="+", default=[20, 100, 500])
+    parser.add_argument("--max-files", type=int, default=100, help="cap on files per run")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,90 @@
+"""Compare the old full-history chat query with the keyset-paginated endpoint.
+
+Seeds a throwaway SQLite database with threads of 10k-100k messages and times
+both read paths. Run from the server directory:
+
+    python benchmarks/chat_history.py --sizes 10000 50000 100000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DB_DIR = tempfile.mkdtemp(prefix="lessin-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DB_DIR, 'chat.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlmodel import SQLModel, select  # noqa: E402
+
+import main  # noqa: E402
+from main import ChatMessage, ChatThread, StudySet, async_session, engine  # noqa: E402
+
+
+async def seed_thread(size: int) -> int:
+    async with async_session() as session:
+        study_set = StudySet(user_id=1, title=f"bench {size}")
+        session.add(study_set)
+        await session.flush()
+        thread = ChatThread(study_set_id=study_set.id)
+        session.add(thread)
+        await session.commit()
+        await session.refresh(thread)
+        thread_id = thread.id
+
+    start = datetime(2025, 1, 1)
+    rows = [
+        {
+            "thread_id": thread_id,
+            "sender": "user" if i % 2 == 0 else "gpt",
+            "content": f"message {i} " + "lorem ipsum " * 20,
+            "created_at": start + timedelta(seconds=i),
+        }
+        for i in range(size)
+    ]
+    async with engine.begin() as conn:
+        await conn.execute(ChatMessage.__table__.insert(), rows)
+    return thread_id
+
+
+async def full_scan(thread_id: int):
+    # the query get_chat_messages used to run: every row, unordered
+    async with async_session() as session:
+        return (await session.exec(select(ChatMessage).where(ChatMessage.thread_id == thread_id))).all()
+
+
+async def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+async def run(args):
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    print(f"{'messages':>10} {'full scan ms':>14} {'latest page ms':>15} {'before ms':>10} {'since ms':>9}")
+    for n, size in enumerate(args.sizes, start=1):
+        thread_id = await seed_thread(size)
+        middle = (await full_scan(thread_id))[size // 2]
+        newest = await main.get_chat_messages(thread_id, before=None, after=None, since=None, limit=10)
+        since = newest[0].created_at
+
+        full_ms = await timed(lambda: full_scan(thread_id), args.repeat)
+        latest_ms = await timed(lambda: main.get_chat_messages(thread_id, None, None, None, main.CHAT_PAGE_DEFAULT), args.repeat)
+        before_ms = await timed(lambda: main.get_chat_messages(thread_id, middle.id, None, None, main.CHAT_PAGE_DEFAULT), args.repeat)
+        since_ms = await timed(lambda: main.get_chat_messages(thread_id, None, None, since, main.CHAT_PAGE_DEFAULT), args.repeat)
+        print(f"{size:>10} {full_ms:>14.2f} {latest_ms:>15.2f} {before_ms:>10.2f} {since_ms:>9.2f}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,126 @@
+"""In-process load test for the Lessin API.
+
+Drives an app through httpx's ASGI transport with a fixed number of concurrent
+clients and reports p50/p99 latency and requests per second per route. Seeding
+goes through the public HTTP API, so the same harness can be pointed at an
+older main.py to get a before/after comparison:
+
+    python benchmarks/load_test.py
+    git show <rev>:server/main.py > /tmp/main_before.py
+    python benchmarks/load_test.py --app /tmp/main_before.py
+"""
+import argparse
+import asyncio
+import importlib
+import inspect
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(path: str):
+    # imported by name, not exec'd from a spec, so the password-hashing worker
+    # processes can import the same module to unpickle its functions
+    directory, filename = os.path.split(os.path.abspath(path))
+    sys.path.insert(0, directory)
+    return importlib.import_module(os.path.splitext(filename)[0]).app
+
+
+async def run_handlers(handlers):
+    for handler in handlers:
+        result = handler()
+        if inspect.isawaitable(result):
+            await result
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def seed(client: httpx.AsyncClient, messages: int):
+    r = await client.post("/signup", data={"username": "bench", "email": "bench@example.com", "password": "bench-password"})
+    user_id = r.json()["id"]
+    for name in ("python", "sql", "linear algebra"):
+        await client.post("/skills", data={"user_id": user_id, "skill_name": name})
+    r = await client.post("/studysets", data={"user_id": user_id, "title": "Bench set", "description": "seeded"})
+    set_id = r.json()["id"]
+    thread_id = (await client.get(f"/chats/thread/{set_id}")).json()["id"]
+    for i in range(messages):
+        sender = "user" if i % 2 == 0 else "gpt"
+        await client.post("/chats/messages", data={"thread_id": thread_id, "sender": sender, "content": f"seed {i}"})
+    return user_id, set_id, thread_id
+
+
+async def hammer(client: httpx.AsyncClient, name: str, make_request, total: int, concurrency: int):
+    latencies = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            t0 = time.perf_counter()
+            response = await make_request()
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: HTTP {response.status_code} {response.text[:200]}")
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    print(
+        f"{name:<28} {total:>7} {statistics.median(latencies):>9.2f} "
+        f"{percentile(latencies, 99):>9.2f} {total / elapsed:>9.1f}"
+    )
+
+
+async def run(args):
+    app = load_app(args.app)
+    await run_handlers(app.router.on_startup)
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            user_id, set_id, thread_id = await seed(client, args.messages)
+            scenarios = [
+                ("GET /profile/{id}", lambda: client.get(f"/profile/{user_id}")),
+                ("GET /studysets/{id}", lambda: client.get(f"/studysets/{user_id}")),
+                ("GET /chats/messages/{id}", lambda: client.get(f"/chats/messages/{thread_id}")),
+                ("POST /chats/messages", lambda: client.post(
+                    "/chats/messages", data={"thread_id": thread_id, "sender": "user", "content": "hi"})),
+                ("POST /login", lambda: client.post(
+                    "/login", data={"username": "bench", "password": "bench-password"})),
+            ]
+            print(f"{'route':<28} {'requests':>7} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+            for name, make_request in scenarios:
+                total = args.requests if not name.endswith("/login") else max(args.concurrency, args.requests // 20)
+                await hammer(client, name, make_request, total, args.concurrency)
+    finally:
+        await run_handlers(app.router.on_shutdown)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--app", default=os.path.join(SERVER_DIR, "main.py"), help="path to the main.py to load")
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200, help="chat messages to seed")
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        db_dir = tempfile.mkdtemp(prefix="lessin-load-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(db_dir, 'load.db')}"
+    # every /login and /signup comes from one client; keep the throttle out of the numbers
+    os.environ.setdefault("LOGIN_MAX_PER_IP", str(10 ** 9))
+    os.environ.setdefault("LOGIN_MAX_PER_USERNAME", str(10 ** 9))
+    # uploads/ and .env are resolved relative to the server directory
+    os.chdir(SERVER_DIR)
+    sys.path.insert(0, SERVER_DIR)
+    asyncio.run(run(args))
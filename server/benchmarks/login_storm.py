@@ -0,0 +1,112 @@
+"""Login throughput and collateral latency during a login storm.
+
+Fires concurrent logins at the app while a second set of clients keeps
+requesting a cheap route (GET /studysets/{user_id}), then reports login
+throughput and the latency of the cheap route. Each hashing mode runs in its
+own process because main.py reads its settings at import:
+
+    python benchmarks/login_storm.py --hash-workers 0 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def storm(args) -> dict:
+    sys.path.insert(0, SERVER_DIR)
+    import main
+
+    await main.on_startup()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        users = []
+        for i in range(args.users):
+            r = await client.post("/signup", data={"username": f"user{i}", "email": "e", "password": f"password{i}"})
+            users.append(r.json()["id"])
+
+        stop = asyncio.Event()
+        login_times, other_times = [], []
+
+        async def login_worker(n: int):
+            i = n
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                r = await client.post("/login", data={"username": f"user{i % args.users}", "password": f"password{i % args.users}"})
+                login_times.append(time.perf_counter() - t0)
+                r.raise_for_status()
+                i += args.login_concurrency
+
+        async def other_worker():
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                (await client.get(f"/studysets/{users[0]}")).raise_for_status()
+                other_times.append((time.perf_counter() - t0) * 1000)
+
+        tasks = [asyncio.create_task(login_worker(n)) for n in range(args.login_concurrency)]
+        tasks += [asyncio.create_task(other_worker()) for _ in range(args.other_concurrency)]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    await main.stop_hash_pool()
+    return {
+        "hash_workers": main.HASH_WORKERS,
+        "logins_per_s": round(len(login_times) / args.duration, 1),
+        "login_p50_ms": round(statistics.median(login_times) * 1000, 1),
+        "other_p50_ms": round(statistics.median(other_times), 2),
+        "other_p99_ms": round(percentile(other_times, 99), 2),
+        "other_req_per_s": round(len(other_times) / args.duration, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hash-workers", type=int, nargs="+", default=[0, os.cpu_count() or 1])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of storm per mode")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--login-concurrency", type=int, default=32)
+    parser.add_argument("--other-concurrency", type=int, default=4)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(storm(args))))
+        sys.exit(0)
+
+    print(f"{'hash workers':>12} {'logins/s':>9} {'login p50':>10} {'other p50':>10} {'other p99':>10} {'other req/s':>12}")
+    for workers in args.hash_workers:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='lessin-storm-'), 'storm.db')}",
+            HASH_WORKERS=str(workers),
+            # the storm must not be throttled
+            LOGIN_MAX_PER_IP="1000000000",
+            LOGIN_MAX_PER_USERNAME="1000000000",
+            EXTRACT_WORKERS="0",
+        )
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--duration", str(args.duration),
+             "--users", str(args.users), "--login-concurrency", str(args.login_concurrency),
+             "--other-concurrency", str(args.other_concurrency)],
+            env=env, cwd=SERVER_DIR, capture_output=True, text=True, check=True,
+        )
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(
+            f"{r['hash_workers']:>12} {r['logins_per_s']:>9} {r['login_p50_ms']:>10} "
+            f"{r['other_p50_ms']:>10} {r['other_p99_ms']:>10} {r['other_req_per_s']:>12}"
+        )
@@ -0,0 +1,71 @@
+"""Throughput of /plans/generate with job coalescing and the plan cache.
+
+Sends a burst of plan requests drawn from a small pool of topic lists (as
+students in one course would), waits for every job, and reports how many
+plans were actually generated. A second burst over the same topics shows the
+cache. Generation uses the stub generator with PLAN_STUB_DELAY seconds:
+
+    python benchmarks/plan_jobs.py --requests 500 --distinct 20 --delay 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def burst(client, topic_lists, requests: int) -> float:
+    t0 = time.perf_counter()
+    responses = await asyncio.gather(*(
+        client.post("/plans/generate", data={"topics": topic_lists[i % len(topic_lists)]}) for i in range(requests)
+    ))
+    pending = {r.json()["job_id"] for r in responses if r.json()["job_id"]}
+    while pending:
+        await asyncio.sleep(0.05)
+        statuses = await asyncio.gather(*(client.get(f"/plans/jobs/{job_id}") for job_id in pending))
+        pending = {s.json()["job_id"] for s in statuses if s.json()["status"] in ("pending", "running")}
+    return time.perf_counter() - t0
+
+
+async def run(args):
+    import httpx
+    import main
+
+    generated = 0
+    stub = main.plan_generator
+
+    async def counting_generator(topics, report):
+        nonlocal generated
+        generated += 1
+        return await stub(topics, report)
+
+    main.plan_generator = counting_generator
+    await main.on_startup()
+    transport = httpx.ASGITransport(app=main.app)
+    topic_lists = [f"Topic {i}, Linear Algebra, SQL" for i in range(args.distinct)]
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'burst':<10} {'requests':>8} {'generated':>9} {'seconds':>8} {'req/s':>8}")
+        for name in ("cold", "cached"):
+            before = generated
+            elapsed = await burst(client, topic_lists, args.requests)
+            print(f"{name:<10} {args.requests:>8} {generated - before:>9} {elapsed:>8.2f} {args.requests / elapsed:>8.1f}")
+    print(f"without coalescing or cache: {2 * args.requests} generations of {args.delay}s each")
+    await main.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=20, help="distinct topic lists")
+    parser.add_argument("--delay", type=float, default=0.5, help="stub generation time per plan")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='lessin-plans-'), 'plans.db')}"
+    os.environ["PLAN_STUB_DELAY"] = str(args.delay)
+    os.environ.setdefault("EXTRACT_WORKERS", "0")
+    os.chdir(SERVER_DIR)
+    sys.path.insert(0, SERVER_DIR)
+    asyncio.run(run(args))
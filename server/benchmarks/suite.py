@@ -0,0 +1,836 @@
+"""Reproducible benchmark suite covering every Lessin API route.
+
+Seeds a throwaway database with a fixed random seed: users with skills and
+experiences, study sets, a large chat thread, multi-MB uploads with extracted
+chunks, and a flashcard deck. Each route scenario then runs in fresh worker
+processes. Every worker drives the app in-process through httpx's ASGI
+transport with --concurrency clients. Workers start together behind a barrier,
+so throughput is measured across all of them. Results are written as JSON:
+latency percentiles, requests per second and the peak RSS of the workers.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --save-baseline baseline.json
+    python benchmarks/suite.py --baseline baseline.json      # exits 1 on a regression
+    python benchmarks/suite.py --only chats --scale 0.1      # quick subset
+
+It runs offline against SQLite by default. --database-url points it at a local
+Postgres; that database's tables are dropped and re-seeded when --reset is
+given. Uploads, vector indexes and the SQLite file live in a temporary
+directory that is removed afterwards.
+
+Not covered: GET /chats/stream/{thread_id}. The ASGI transport buffers whole
+responses, so a never-ending SSE response cannot be timed in-process.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUITE_VERSION = 1
+SEED = 1234
+WARMUP = 3  # untimed requests per worker before the barrier
+BARRIER_TIMEOUT = 600
+BENCH_PASSWORD = "bench-password"
+SEED_SIZES = {  # at --scale 1
+    "users": 1000,
+    "skills_per_user": 8,
+    "experiences_per_user": 4,
+    "sets_per_user": 2,
+    "messages": 50000,
+    "files": 8,
+    "chunks": 5000,
+    "flashcards": 10000,
+}
+WORDS = (
+    "cell membrane nucleus mitochondria ribosome protein enzyme energy glucose photosynthesis "
+    "derivative integral limit vector matrix eigenvalue theorem proof function series "
+    "revolution empire treaty constitution election parliament colony trade war reform "
+    "algorithm recursion complexity graph tree hash array pointer compiler network "
+    "supply demand market inflation interest capital labor policy growth budget"
+).split()
+SEARCH_TERM = "mitochondria"
+PLAN_TOPICS = ["biology, chemistry", "calculus", "us history, civics", "algorithms, data structures"]
+# a 100-byte slice of a seeded upload, as a PDF viewer would fetch it
+RANGE_HEADER = {"range": "bytes=65536-65635"}
+
+
+def text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB elsewhere
+
+
+async def run_handlers(handlers):
+    for handler in handlers:
+        result = handler()
+        if inspect.isawaitable(result):
+            await result
+
+
+def app_client(main) -> httpx.AsyncClient:
+    # app errors come back as 500 responses and are counted, not raised
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None)
+
+
+# Seeding
+
+async def seed(main, scale: float, upload_mb: float) -> dict:
+    """Fill the database and return the ids scenarios need."""
+    from sqlmodel import select
+
+    rng = random.Random(SEED)
+    counts = {name: max(1, int(size * scale)) for name, size in SEED_SIZES.items()}
+    counts["users"] = max(counts["users"], 64)  # one user of its own per worker
+    password = main.hash_password(BENCH_PASSWORD)
+    start = datetime(2025, 1, 1)
+
+    async with main.engine.begin() as conn:
+        await conn.execute(main.User.__table__.insert(), [
+            {"username": f"user{i:05d}", "email": f"user{i:05d}@example.com", "password": password}
+            for i in range(counts["users"])
+        ])
+        user_ids = (await conn.execute(select(main.User.id).order_by(main.User.id))).scalars().all()
+        await conn.execute(main.Skill.__table__.insert(), [
+            {"user_id": user_id, "skill_name": rng.choice(WORDS)}
+            for user_id in user_ids for _ in range(counts["skills_per_user"])
+        ])
+        await conn.execute(main.Experience.__table__.insert(), [
+            {
+                "user_id": user_id, "title": text(rng, 2).title(), "company": text(rng, 1).title(),
+                "location": "Remote", "start_date": start.date(), "bullets": json.dumps([text(rng, 12), text(rng, 12)]),
+            }
+            for user_id in user_ids for _ in range(counts["experiences_per_user"])
+        ])
+        await conn.execute(main.StudySet.__table__.insert(), [
+            {"user_id": user_id, "title": text(rng, 3).title(), "description": text(rng, 10), "created_at": start}
+            for user_id in user_ids for _ in range(counts["sets_per_user"])
+        ])
+        set_id = (await conn.execute(
+            select(main.StudySet.id).where(main.StudySet.user_id == user_ids[0]).order_by(main.StudySet.id)
+        )).scalars().first()
+        await conn.execute(main.ChatThread.__table__.insert(), [{"study_set_id": set_id, "created_at": start}])
+        thread_id = (await conn.execute(select(main.ChatThread.id))).scalar_one()
+        await conn.execute(main.ChatMessage.__table__.insert(), [
+            {
+                "thread_id": thread_id, "sender": "user" if i % 2 == 0 else "gpt",
+                "content": text(rng, 30), "created_at": start + timedelta(seconds=i),
+            }
+            for i in range(counts["messages"])
+        ])
+        message_ids = (await conn.execute(
+            select(main.ChatMessage.id).where(main.ChatMessage.thread_id == thread_id).order_by(main.ChatMessage.id)
+        )).scalars().all()
+
+    # uploads go through the real route, so blobs are hashed and stored as in production
+    file_ids, blob_url = [], None
+    async with app_client(main) as client:
+        for i in range(counts["files"]):
+            payload = rng.randbytes(int(upload_mb * 1024 * 1024))
+            r = await client.post("/studyfiles", data={"study_set_id": set_id}, files={"file": (f"notes-{i}.pdf", payload)})
+            r.raise_for_status()
+            file_ids.append(r.json()["id"])
+            blob_url = r.json()["file_url"]
+        r = await client.post("/resumes", data={"user_id": user_ids[0]}, files={"file": ("resume.pdf", rng.randbytes(256 * 1024))})
+        r.raise_for_status()
+
+    async with main.engine.begin() as conn:
+        await conn.execute(main.FileChunk.__table__.insert(), [
+            {
+                "study_file_id": file_ids[i % len(file_ids)], "chunk_index": i // len(file_ids),
+                "page_start": i // len(file_ids) + 1, "page_end": i // len(file_ids) + 1,
+                "char_start": 0, "char_end": 1500, "content": text(rng, 220),
+            }
+            for i in range(counts["chunks"])
+        ])
+        await conn.execute(main.Flashcard.__table__.insert(), [
+            {"study_set_id": set_id, "front": text(rng, 8) + "?", "back": text(rng, 15), "created_at": start}
+            for _ in range(counts["flashcards"])
+        ])
+        card_ids = (await conn.execute(
+            select(main.Flashcard.id).where(main.Flashcard.study_set_id == set_id).order_by(main.Flashcard.id)
+        )).scalars().all()
+        # half the deck is due, the rest is spread over the next month
+        await conn.execute(main.FlashcardState.__table__.insert(), [
+            {
+                "card_id": card_id, "study_set_id": set_id, "user_id": user_ids[0],
+                "due_at": datetime.utcnow() + timedelta(hours=rng.uniform(-720, 720)),
+            }
+            for card_id in card_ids
+        ])
+    await main.sync_vector_index(set_id)  # the retrieve scenario measures warm queries
+
+    return {
+        "counts": counts,
+        "user_ids": user_ids[:64],
+        "user_id": user_ids[0],
+        "username": "user00000",
+        "set_id": set_id,
+        "thread_id": thread_id,
+        "middle_message_id": message_ids[len(message_ids) // 2],
+        "file_ids": file_ids,
+        "blob_url": blob_url,
+        "card_ids": [card_ids[0], card_ids[-1]],
+    }
+
+
+# Scenarios
+# Each scenario is a request coroutine called with a per-worker request number k
+# (unique within the worker), plus an optional setup that creates the rows it
+# consumes before timing starts.
+
+class Context:
+    def __init__(self, main, client: httpx.AsyncClient, fixture: dict, worker: int, run_id: str):
+        self.main = main
+        self.client = client
+        self.fixture = fixture
+        self.worker = worker
+        self.run_id = run_id
+        self.rng = random.Random(f"{SEED}-{worker}")
+        self.user_id = fixture["user_ids"][worker % len(fixture["user_ids"])]  # this worker's own user
+        self.state = None
+
+    def key(self, k: int) -> str:
+        return f"{self.run_id}-{self.worker}-{k}"
+
+
+class Scenario:
+    def __init__(self, name: str, request, weight: float, setup):
+        self.name = name
+        self.request = request
+        self.weight = weight  # fraction of --requests; expensive routes run fewer
+        self.setup = setup
+
+
+SCENARIOS = {}
+
+
+def scenario(name: str, weight: float = 1.0, setup=None):
+    def register(fn):
+        SCENARIOS[name] = Scenario(name, fn, weight, setup)
+        return fn
+    return register
+
+
+async def created_ids(responses) -> list:
+    ids = []
+    for r in await asyncio.gather(*responses):
+        r.raise_for_status()
+        ids.append(r.json()["id"])
+    return ids
+
+
+def payload(ctx: Context, k: int, size: int) -> bytes:
+    # random but reproducible, and distinct per request so deduplication does not skip the write
+    return ctx.key(k).encode().ljust(64, b"-") + ctx.rng.randbytes(size - 64)
+
+
+# Auth
+
+@scenario("POST /signup", weight=0.1)
+async def signup(ctx, k):
+    username = f"new-{ctx.key(k)}"
+    return await ctx.client.post("/signup", data={"username": username, "email": f"{username}@example.com", "password": BENCH_PASSWORD})
+
+
+@scenario("POST /login", weight=0.1)
+async def login(ctx, k):
+    return await ctx.client.post("/login", data={"username": ctx.fixture["username"], "password": BENCH_PASSWORD})
+
+
+@scenario("POST /survey")
+async def survey(ctx, k):
+    preferences = json.dumps({"goals": ["exam prep"], "minutes_per_day": 30 + k % 60})
+    return await ctx.client.post("/survey", data={"user_id": ctx.user_id, "preferences": preferences})
+
+
+# Profile
+
+@scenario("GET /profile/{user_id}")
+async def profile(ctx, k):
+    return await ctx.client.get(f"/profile/{ctx.fixture['user_ids'][k % len(ctx.fixture['user_ids'])]}")
+
+
+@scenario("POST /skills")
+async def add_skill(ctx, k):
+    return await ctx.client.post("/skills", data={"user_id": ctx.user_id, "skill_name": ctx.rng.choice(WORDS)})
+
+
+async def setup_skills(ctx, count):
+    return await created_ids(
+        ctx.client.post("/skills", data={"user_id": ctx.user_id, "skill_name": ctx.rng.choice(WORDS)}) for _ in range(count)
+    )
+
+
+@scenario("DELETE /skills/{skill_id}", setup=setup_skills)
+async def delete_skill(ctx, k):
+    return await ctx.client.delete(f"/skills/{ctx.state[k]}")
+
+
+@scenario("POST /skills/batch")
+async def replace_skills(ctx, k):
+    names = WORDS[k % 10:k % 10 + 8]
+    return await ctx.client.post("/skills/batch", data={"user_id": ctx.user_id, "skills_json": json.dumps(names)})
+
+
+@scenario("POST /skills/bulk")
+async def bulk_skills(ctx, k):
+    operations = [{"op": "create", "data": {"skill_name": ctx.rng.choice(WORDS)}} for _ in range(10)]
+    return await ctx.client.post("/skills/bulk", json={"user_id": ctx.user_id, "operations": operations})
+
+
+@scenario("POST /resumes", weight=0.25)
+async def add_resume(ctx, k):
+    return await ctx.client.post("/resumes", data={"user_id": ctx.user_id}, files={"file": ("resume.pdf", payload(ctx, k, 256 * 1024))})
+
+
+async def setup_resumes(ctx, count):
+    return await created_ids(
+        ctx.client.post("/resumes", data={"user_id": ctx.user_id}, files={"file": ("resume.pdf", payload(ctx, -1 - i, 4096))})
+        for i in range(count)
+    )
+
+
+@scenario("DELETE /resumes/{resume_id}", weight=0.25, setup=setup_resumes)
+async def delete_resume(ctx, k):
+    return await ctx.client.delete(f"/resumes/{ctx.state[k]}")
+
+
+def experience_form(ctx) -> dict:
+    return {
+        "title": text(ctx.rng, 2).title(), "company": text(ctx.rng, 1).title(), "location": "Remote",
+        "start_date": "2024-01-01", "bullets_json": json.dumps([text(ctx.rng, 12) for _ in range(3)]),
+    }
+
+
+@scenario("POST /experiences")
+async def add_experience(ctx, k):
+    return await ctx.client.post("/experiences", data={"user_id": ctx.user_id, **experience_form(ctx)})
+
+
+async def setup_experiences(ctx, count):
+    return await created_ids(
+        ctx.client.post("/experiences", data={"user_id": ctx.user_id, **experience_form(ctx)}) for _ in range(count)
+    )
+
+
+@scenario("PUT /experiences/{experience_id}", setup=setup_experiences)
+async def update_experience(ctx, k):
+    return await ctx.client.put(f"/experiences/{ctx.state[k]}", data=experience_form(ctx))
+
+
+@scenario("DELETE /experiences/{experience_id}", setup=setup_experiences)
+async def delete_experience(ctx, k):
+    return await ctx.client.delete(f"/experiences/{ctx.state[k]}")
+
+
+@scenario("POST /experiences/bulk")
+async def bulk_experiences(ctx, k):
+    operations = [
+        {"op": "create", "data": {"title": "Tutor", "company": "Lessin", "bullets": [text(ctx.rng, 12)]}} for _ in range(10)
+    ]
+    return await ctx.client.post("/experiences/bulk", json={"user_id": ctx.user_id, "operations": operations})
+
+
+# Study sets
+
+@scenario("POST /studysets")
+async def add_study_set(ctx, k):
+    return await ctx.client.post("/studysets", data={"user_id": ctx.user_id, "title": text(ctx.rng, 3), "description": text(ctx.rng, 10)})
+
+
+@scenario("GET /studysets/{user_id}")
+async def list_study_sets(ctx, k):
+    return await ctx.client.get(f"/studysets/{ctx.fixture['user_ids'][k % len(ctx.fixture['user_ids'])]}")
+
+
+async def setup_own_set(ctx, count):
+    r = await ctx.client.post("/studysets", data={"user_id": ctx.user_id, "title": "mine"})
+    r.raise_for_status()
+    return r.json()["id"]
+
+
+@scenario("PUT /studysets/{set_id}", setup=setup_own_set)
+async def update_study_set(ctx, k):
+    return await ctx.client.put(f"/studysets/{ctx.state}", data={"title": text(ctx.rng, 3), "description": text(ctx.rng, 10)})
+
+
+async def setup_full_sets(ctx, count):
+    # sets with a chat history, a file and its chunks, so the delete cascades
+    main = ctx.main
+    async with main.engine.begin() as conn:
+        set_ids = []
+        for _ in range(count):
+            set_id = (await conn.execute(main.StudySet.__table__.insert().values(user_id=ctx.user_id, title="doomed"))).inserted_primary_key[0]
+            thread_id = (await conn.execute(main.ChatThread.__table__.insert().values(study_set_id=set_id))).inserted_primary_key[0]
+            await conn.execute(main.ChatMessage.__table__.insert(), [
+                {"thread_id": thread_id, "sender": "user", "content": text(ctx.rng, 30)} for _ in range(100)
+            ])
+            file_id = (await conn.execute(main.StudyFile.__table__.insert().values(
+                study_set_id=set_id, file_name="doomed.pdf", file_url=ctx.fixture["blob_url"]
+            ))).inserted_primary_key[0]
+            await conn.execute(main.FileChunk.__table__.insert(), [
+                {"study_file_id": file_id, "chunk_index": i, "page_start": 1, "page_end": 1, "char_start": 0, "char_end": 1, "content": text(ctx.rng, 200)}
+                for i in range(20)
+            ])
+            set_ids.append(set_id)
+    return set_ids
+
+
+@scenario("DELETE /studysets/{set_id}", setup=setup_full_sets)
+async def delete_study_set(ctx, k):
+    return await ctx.client.delete(f"/studysets/{ctx.state[k]}")
+
+
+# Study files and uploads
+
+@scenario("POST /studyfiles", weight=0.1, setup=setup_own_set)
+async def add_study_file(ctx, k):
+    size = int(ctx.fixture["upload_mb"] * 1024 * 1024)
+    return await ctx.client.post("/studyfiles", data={"study_set_id": ctx.state}, files={"file": ("notes.pdf", payload(ctx, k, size))})
+
+
+@scenario("POST /studyfiles/batch", weight=0.05, setup=setup_own_set)
+async def add_study_files(ctx, k):
+    files = [("files", (f"part-{i}.pdf", payload(ctx, k * 3 + i, 1024 * 1024))) for i in range(3)]
+    return await ctx.client.post("/studyfiles/batch", data={"study_set_id": ctx.state}, files=files)
+
+
+@scenario("POST /studyfiles/bulk")
+async def rename_study_files(ctx, k):
+    operations = [{"op": "update", "id": file_id, "data": {"file_name": f"notes-{k}.pdf"}} for file_id in ctx.fixture["file_ids"]]
+    return await ctx.client.post("/studyfiles/bulk", json={"study_set_id": ctx.fixture["set_id"], "operations": operations})
+
+
+@scenario("GET /studyfiles/{study_set_id}")
+async def list_study_files(ctx, k):
+    return await ctx.client.get(f"/studyfiles/{ctx.fixture['set_id']}")
+
+
+async def setup_file_rows(ctx, count):
+    main = ctx.main
+    async with main.engine.begin() as conn:
+        file_ids = []
+        for _ in range(count):
+            file_id = (await conn.execute(main.StudyFile.__table__.insert().values(
+                study_set_id=ctx.fixture["set_id"], file_name="doomed.pdf", file_url=ctx.fixture["blob_url"]
+            ))).inserted_primary_key[0]
+            await conn.execute(main.FileChunk.__table__.insert(), [
+                {"study_file_id": file_id, "chunk_index": i, "page_start": 1, "page_end": 1, "char_start": 0, "char_end": 1, "content": text(ctx.rng, 200)}
+                for i in range(20)
+            ])
+            file_ids.append(file_id)
+    return file_ids
+
+
+@scenario("DELETE /studyfiles/{file_id}", setup=setup_file_rows)
+async def delete_study_file(ctx, k):
+    return await ctx.client.delete(f"/studyfiles/{ctx.state[k]}")
+
+
+@scenario("GET /studyfiles/{file_id}/extraction")
+async def extraction_status(ctx, k):
+    return await ctx.client.get(f"/studyfiles/{ctx.fixture['file_ids'][k % len(ctx.fixture['file_ids'])]}/extraction")
+
+
+@scenario("POST /uploads/sessions")
+async def create_upload_session(ctx, k):
+    return await ctx.client.post("/uploads/sessions", data={"file_name": "big.pdf", "size": 1024 * 1024})
+
+
+async def setup_upload_sessions(ctx, count):
+    sessions = []
+    for _ in range(count):
+        r = await ctx.client.post("/uploads/sessions", data={"file_name": "big.pdf", "size": 1024 * 1024})
+        r.raise_for_status()
+        sessions.append(r.json()["upload_id"])
+    return sessions
+
+
+@scenario("GET /uploads/sessions/{upload_id}", setup=setup_upload_sessions)
+async def get_upload_session(ctx, k):
+    return await ctx.client.get(f"/uploads/sessions/{ctx.state[k]}")
+
+
+@scenario("PUT /uploads/sessions/{upload_id}", weight=0.25, setup=setup_upload_sessions)
+async def put_upload_chunk(ctx, k):
+    return await ctx.client.put(f"/uploads/sessions/{ctx.state[k]}", params={"offset": 0}, content=payload(ctx, k, 1024 * 1024))
+
+
+@scenario("GET /uploads/{file_path}", weight=0.25)
+async def get_upload(ctx, k):
+    return await ctx.client.get(ctx.fixture["blob_url"])
+
+
+@scenario("GET /uploads/{file_path} (range)")
+async def get_upload_range(ctx, k):
+    return await ctx.client.get(ctx.fixture["blob_url"], headers=RANGE_HEADER)
+
+
+# Chat
+
+@scenario("GET /chats/thread/{study_set_id}")
+async def get_thread(ctx, k):
+    return await ctx.client.get(f"/chats/thread/{ctx.fixture['set_id']}")
+
+
+@scenario("GET /chats/messages/{thread_id}")
+async def latest_messages(ctx, k):
+    return await ctx.client.get(f"/chats/messages/{ctx.fixture['thread_id']}")
+
+
+@scenario("GET /chats/messages/{thread_id}?before")
+async def older_messages(ctx, k):
+    return await ctx.client.get(f"/chats/messages/{ctx.fixture['thread_id']}", params={"before": ctx.fixture["middle_message_id"]})
+
+
+@scenario("POST /chats/messages")
+async def add_message(ctx, k):
+    return await ctx.client.post("/chats/messages", data={"thread_id": ctx.fixture["thread_id"], "sender": "user", "content": text(ctx.rng, 30)})
+
+
+# Search and retrieval
+
+@scenario("GET /search")
+async def search(ctx, k):
+    return await ctx.client.get("/search", params={"user_id": ctx.fixture["user_id"], "q": SEARCH_TERM})
+
+
+@scenario("GET /studysets/{set_id}/retrieve")
+async def retrieve(ctx, k):
+    return await ctx.client.get(f"/studysets/{ctx.fixture['set_id']}/retrieve", params={"q": text(ctx.rng, 6)})
+
+
+# Flashcards
+
+@scenario("GET /flashcards/due?study_set_id")
+async def due_in_set(ctx, k):
+    return await ctx.client.get("/flashcards/due", params={"study_set_id": ctx.fixture["set_id"]})
+
+
+@scenario("GET /flashcards/due?user_id")
+async def due_for_user(ctx, k):
+    return await ctx.client.get("/flashcards/due", params={"user_id": ctx.fixture["user_id"]})
+
+
+@scenario("GET /flashcards/{study_set_id}")
+async def list_flashcards(ctx, k):
+    first, last = ctx.fixture["card_ids"]
+    return await ctx.client.get(f"/flashcards/{ctx.fixture['set_id']}", params={"after": ctx.rng.randint(first, last)})
+
+
+@scenario("POST /flashcards/bulk")
+async def bulk_flashcards(ctx, k):
+    operations = [{"op": "create", "data": {"front": text(ctx.rng, 8) + "?", "back": text(ctx.rng, 15)}} for _ in range(20)]
+    return await ctx.client.post("/flashcards/bulk", json={"study_set_id": ctx.fixture["set_id"], "operations": operations})
+
+
+@scenario("POST /flashcards/reviews")
+async def review_flashcards(ctx, k):
+    first, last = ctx.fixture["card_ids"]
+    reviews = [{"card_id": ctx.rng.randint(first, last), "grade": ctx.rng.randint(0, 5)} for _ in range(20)]
+    return await ctx.client.post("/flashcards/reviews", json={"user_id": ctx.fixture["user_id"], "reviews": reviews})
+
+
+# Plans
+
+@scenario("POST /plans/generate")
+async def generate_plan(ctx, k):
+    return await ctx.client.post("/plans/generate", data={"topics": PLAN_TOPICS[k % len(PLAN_TOPICS)]})
+
+
+async def setup_plan_job(ctx, count):
+    r = await ctx.client.post("/plans/generate", data={"topics": f"bench topic {ctx.key(0)}"})
+    r.raise_for_status()
+    return r.json()["job_id"]
+
+
+@scenario("GET /plans/jobs/{job_id}", setup=setup_plan_job)
+async def plan_job(ctx, k):
+    return await ctx.client.get(f"/plans/jobs/{ctx.state}")
+
+
+# Operations
+
+@scenario("GET /metrics")
+async def metrics(ctx, k):
+    return await ctx.client.get("/metrics")
+
+
+@scenario("GET /maintenance/gc", weight=0.05)
+async def gc_report(ctx, k):
+    return await ctx.client.get("/maintenance/gc")
+
+
+@scenario("POST /maintenance/gc", weight=0.05)
+async def gc_run(ctx, k):
+    return await ctx.client.post("/maintenance/gc")
+
+
+# Workers
+
+async def run_worker(name: str, worker: int, count: int, concurrency: int, fixture: dict, run_id: str, barrier) -> dict:
+    import main
+
+    spec = SCENARIOS[name]
+    await run_handlers(main.app.router.on_startup)
+    try:
+        async with app_client(main) as client:
+            ctx = Context(main, client, fixture, worker, run_id)
+            if spec.setup:
+                ctx.state = await spec.setup(ctx, count + WARMUP)
+            for k in range(WARMUP):
+                await spec.request(ctx, k)
+            await asyncio.to_thread(barrier.wait, BARRIER_TIMEOUT)
+
+            latencies, errors, error_sample = [], 0, None
+            pending = iter(range(WARMUP, WARMUP + count))
+
+            async def client_loop():
+                nonlocal errors, error_sample
+                for k in pending:
+                    t0 = time.perf_counter()
+                    response = await spec.request(ctx, k)
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                    if response.status_code >= 400:
+                        errors += 1
+                        error_sample = error_sample or f"HTTP {response.status_code}: {response.text[:200]}"
+
+            started = time.monotonic()  # system-wide clock, comparable between workers
+            await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+            finished = time.monotonic()
+    finally:
+        await run_handlers(main.app.router.on_shutdown)
+    return {
+        "latencies": latencies, "errors": errors, "error_sample": error_sample,
+        "started": started, "finished": finished, "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def worker_entry(name, worker, count, concurrency, fixture, run_id, barrier, results):
+    try:
+        results.put((worker, asyncio.run(run_worker(name, worker, count, concurrency, fixture, run_id, barrier))))
+    except BaseException as exc:
+        barrier.abort()  # release the other workers instead of leaving them waiting
+        results.put((worker, {"failed": f"{type(exc).__name__}: {exc}"}))
+
+
+def run_scenario(spec: Scenario, args, fixture: dict, run_id: str) -> dict:
+    mp = multiprocessing.get_context("spawn")
+    count = max(1, int(args.requests * spec.weight))
+    barrier = mp.Barrier(args.workers)
+    results = mp.Queue()
+    processes = [
+        mp.Process(target=worker_entry, args=(spec.name, w, count, args.concurrency, fixture, run_id, barrier, results))
+        for w in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    failures = [outcome["failed"] for _, outcome in outcomes if "failed" in outcome]
+    if failures:
+        return {"failed": failures[0]}
+    latencies = [ms for _, outcome in outcomes for ms in outcome["latencies"]]
+    elapsed = max(o["finished"] for _, o in outcomes) - min(o["started"] for _, o in outcomes)
+    return {
+        "requests": len(latencies),
+        "errors": sum(o["errors"] for _, o in outcomes),
+        "error_sample": next((o["error_sample"] for _, o in outcomes if o["error_sample"]), None),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p90_ms": round(percentile(latencies, 90), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "peak_rss_mb": round(max(o["peak_rss_mb"] for _, o in outcomes), 1),
+    }
+
+
+# Baseline comparison
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    """Print current against baseline numbers; return the regressions found."""
+    regressions = []
+    for key in ("database", "workers", "concurrency", "requests", "scale", "upload_mb"):
+        if results["meta"].get(key) != baseline["meta"].get(key):
+            print(f"warning: {key} differs from the baseline ({baseline['meta'].get(key)} -> {results['meta'].get(key)})")
+    print(f"\n{'route':<42} {'p50 ms':>17} {'p99 ms':>17} {'req/s':>17} {'rss MB':>15}")
+    for name, now in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None or "failed" in before or "failed" in now:
+            if "failed" in now:
+                regressions.append(f"{name}: failed ({now['failed']})")
+            continue
+        cells = []
+        for metric, higher_is_worse in (("p50_ms", True), ("p99_ms", True), ("throughput_rps", False), ("peak_rss_mb", True)):
+            old, new = before[metric], now[metric]
+            cells.append(f"{old:>7} -> {new:<7}")
+            if not old or new is None:
+                continue
+            if higher_is_worse:
+                # latency deltas below min_delta_ms are treated as noise
+                worse = new > old * (1 + tolerance) and (metric == "peak_rss_mb" or new - old > min_delta_ms)
+            else:
+                worse = new < old * (1 - tolerance)
+            if worse:
+                regressions.append(f"{name}: {metric} {old} -> {new}")
+        if now["errors"] > before["errors"]:
+            regressions.append(f"{name}: errors {before['errors']} -> {now['errors']}")
+        print(f"{name:<42} " + " ".join(cells))
+    return regressions
+
+
+# Main
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def prepare(args) -> dict:
+    import main
+    from sqlmodel import SQLModel, select
+
+    if args.reset:
+        async with main.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.drop_all)
+    await run_handlers(main.app.router.on_startup)
+    try:
+        async with main.async_session() as session:
+            if (await session.exec(select(main.User.id).limit(1))).first() is not None:
+                raise SystemExit("The database already has users; use a dedicated database and pass --reset")
+        fixture = await seed(main, args.scale, args.upload_mb)
+    finally:
+        await run_handlers(main.app.router.on_shutdown)
+    fixture["upload_mb"] = args.upload_mb
+    return fixture
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    parser.add_argument("--reset", action="store_true", help="drop all tables in --database-url before seeding")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="load generator processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients per worker")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per worker and route (scaled by route weight)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the seeded data sizes")
+    parser.add_argument("--upload-mb", type=float, default=4.0, help="size of each seeded and uploaded study file")
+    parser.add_argument("--only", nargs="+", help="run routes whose name contains any of these strings")
+    parser.add_argument("--list", action="store_true", help="list the routes and exit")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--save-baseline", help="also write results JSON here, for later --baseline runs")
+    parser.add_argument("--baseline", help="results JSON to compare against; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before failing")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore latency regressions smaller than this")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory with the database and uploads")
+    args = parser.parse_args()
+    for option in ("output", "save_baseline", "baseline"):  # relative to where the suite was started
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+
+    selected = [s for s in SCENARIOS.values() if not args.only or any(part in s.name for part in args.only)]
+    if args.list:
+        for spec in selected:
+            print(spec.name)
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix="lessin-suite-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'suite.db')}"
+    # fixed, quiet settings; background jobs off and login throttling out of the way
+    for name, value in {
+        "EXTRACT_WORKERS": "0", "GC_INTERVAL_SECONDS": "0",
+        "LOGIN_MAX_PER_IP": str(10 ** 9), "LOGIN_MAX_PER_USERNAME": str(10 ** 9),
+    }.items():
+        os.environ.setdefault(name, value)
+    # uploads/, uploads_partial/, vectors/ etc. are relative to the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, SERVER_DIR)
+
+    try:
+        t0 = time.perf_counter()
+        fixture = asyncio.run(prepare(args))
+        print(f"seeded {fixture['counts']} in {time.perf_counter() - t0:.1f}s")
+        results = {
+            "meta": {
+                "suite_version": SUITE_VERSION,
+                "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                "git_revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "database": os.environ["DATABASE_URL"].split(":", 1)[0].split("+")[0],
+                "workers": args.workers,
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "scale": args.scale,
+                "upload_mb": args.upload_mb,
+                "seed": fixture["counts"],
+            },
+            "scenarios": {},
+        }
+        run_id = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        print(f"{'route':<42} {'requests':>8} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'rss MB':>7} {'errors':>6}")
+        for spec in selected:
+            result = run_scenario(spec, args, fixture, run_id)
+            results["scenarios"][spec.name] = result
+            if "failed" in result:
+                print(f"{spec.name:<42} failed: {result['failed']}")
+                continue
+            print(
+                f"{spec.name:<42} {result['requests']:>8} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                f"{result['throughput_rps']:>9.1f} {result['peak_rss_mb']:>7.1f} {result['errors']:>6}"
+            )
+    finally:
+        os.chdir(SERVER_DIR)
+        if args.keep:
+            print(f"kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = [name for name, result in results["scenarios"].items() if "failed" in result]
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("\nregressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nno regressions")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
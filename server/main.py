@@ -1,24 +1,128 @@
-from fastapi import FastAPI, Form, HTTPException, Path, UploadFile, File
+from fastapi import FastAPI, Form, HTTPException, Path, Query, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import SQLModel, Field, create_engine, Session, select, UniqueConstraint
-import shutil
-from typing import Optional, List
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlmodel import SQLModel, Field, select, UniqueConstraint
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import (
+    Date, Index, Integer, String, cast, delete, func, insert, inspect, literal, null, or_, text, tuple_, union_all, update,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.requests import ClientDisconnect
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
+from functools import lru_cache
+import asyncio
+import bisect
+import copy
+import gzip
+import hashlib
+import mimetypes
+import multiprocessing
+import re
+import tempfile
+import uuid
+import zlib
+from typing import AsyncIterator, Awaitable, Callable, Dict, Literal, Optional, List, Set, Tuple
 from enum import Enum
 import os
 import json
+import logging
+import random
+import threading
+import time
+import numpy as np
 from dotenv import load_dotenv
 from passlib.context import CryptContext
-from datetime import date, datetime
+from datetime import date, datetime, timedelta, timezone
+
+try:
+    import brotli  # optional: enables br-encoded variants
+except ImportError:
+    brotli = None
+
+try:
+    import redis.asyncio as redis_asyncio  # optional: shared response cache
+except ImportError:
+    redis_asyncio = None
+
+try:
+    from pypdf import PdfReader  # optional: needed to extract text from PDFs
+except ImportError:
+    PdfReader = None
+
+try:
+    import fcntl  # POSIX only: locks vector index files across worker processes
+except ImportError:
+    fcntl = None
 
 # Load environment variables
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+def env_flag(name: str, default: bool = False) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+def async_database_url(url: str) -> URL:
+    # swap sync drivers (psycopg2, pysqlite) for their async counterparts
+    url = make_url(url.replace("postgres://", "postgresql://", 1))
+    backend = url.get_backend_name()
+    if backend == "postgresql" and url.get_driver_name() != "asyncpg":
+        url = url.set(drivername="postgresql+asyncpg")
+    elif backend == "sqlite" and url.get_driver_name() != "aiosqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url
+
 # DB engine
-engine = create_engine(DATABASE_URL, echo=True)
+db_url = async_database_url(DATABASE_URL)
+engine_options = {
+    "echo": env_flag("DB_ECHO"),
+    "pool_pre_ping": env_flag("DB_POOL_PRE_PING", True),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),  # seconds
+}
+if db_url.get_backend_name() != "sqlite":
+    engine_options["pool_size"] = int(os.getenv("DB_POOL_SIZE", "10"))
+    engine_options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    engine_options["pool_timeout"] = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+class TimedCheckoutPool:
+    # mixed into the engine's default pool class; _do_get is where a checkout waits
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - t0)
+
+def timed_pool_class(url: URL, options: dict):
+    default = type(create_async_engine(url, **options).sync_engine.pool)  # no connection is opened
+    return type(f"Timed{default.__name__}", (TimedCheckoutPool, default), {})
+
+engine = create_async_engine(db_url, poolclass=timed_pool_class(db_url, engine_options), **engine_options)
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+if db_url.get_backend_name() == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+        # SQLite ignores FOREIGN KEY clauses (and their cascades) unless enabled per connection
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 
 # Password hashing setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt runs in a process pool so a burst of logins can use every core without
+# holding the GIL or the request threadpool. HASH_WORKERS=0 hashes in threads.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(max(HASH_WORKERS, 1) * 4)))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+hash_pool: Optional[ProcessPoolExecutor] = None
+hash_slots: Optional[asyncio.Semaphore] = None
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -26,6 +130,140 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # the new hash is set when the stored one uses an outdated cost or scheme
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+async def run_hashing(fn, *args):
+    global hash_pool, hash_slots
+    if hash_slots is None:
+        hash_slots = asyncio.Semaphore(HASH_MAX_PENDING)
+    async with hash_slots:
+        if HASH_WORKERS <= 0:
+            return await run_in_threadpool(fn, *args)
+        if hash_pool is None:
+            # spawned, not forked: by now the event loop and threadpool threads exist
+            hash_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return await asyncio.get_running_loop().run_in_executor(hash_pool, fn, *args)
+
+# Login throttling
+# Every attempt costs a bcrypt verification, so attempts (not only failures) are
+# limited per username and per client IP within a sliding window.
+# Behind a reverse proxy (Render's load balancer) the socket peer is the proxy,
+# so set TRUSTED_PROXY_HOPS to the number of proxies in front of the app; the
+# client is then read from X-Forwarded-For, counting that many entries from the
+# right, since only those were appended by proxies we trust.
+LOGIN_WINDOW_SECONDS = int(os.getenv("LOGIN_WINDOW_SECONDS", "60"))
+LOGIN_MAX_PER_USERNAME = int(os.getenv("LOGIN_MAX_PER_USERNAME", "10"))
+LOGIN_MAX_PER_IP = int(os.getenv("LOGIN_MAX_PER_IP", "30"))
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+def client_ip(request: Request) -> str:
+    if TRUSTED_PROXY_HOPS > 0:
+        forwarded = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+class RateLimiter:
+    def __init__(self, window: int):
+        self.window = window
+        self.hits: Dict[str, deque] = {}
+        self.last_sweep = time.monotonic()
+
+    def hit(self, key: str, limit: int) -> Optional[int]:
+        """Record an attempt; returns seconds to wait if the key is over its limit."""
+        now = time.monotonic()
+        if now - self.last_sweep > self.window:
+            # forget keys with no attempts inside the window
+            self.hits = {k: q for k, q in self.hits.items() if q and q[-1] > now - self.window}
+            self.last_sweep = now
+        attempts = self.hits.setdefault(key, deque())
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if len(attempts) >= limit:
+            return max(1, int(attempts[0] + self.window - now) + 1)
+        attempts.append(now)
+        return None
+
+login_limiter = RateLimiter(LOGIN_WINDOW_SECONDS)
+
+def throttle(*keys_and_limits: Tuple[str, int]):
+    for key, limit in keys_and_limits:
+        retry_after = login_limiter.hit(key, limit)
+        if retry_after is not None:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts, try again later",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+# Response caching
+# Small per-key cache for rendered responses. Each process keeps its own LRU;
+# set CACHE_REDIS_URL (any Redis-compatible server) to share entries and
+# invalidations between workers.
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+class MemoryCache:
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.counters: Dict[str, int] = {}  # kept apart from entries so LRU eviction never resets them
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def delete(self, key: str):
+        self.entries.pop(key, None)
+
+    async def counter(self, key: str) -> int:
+        return self.counters.get(key, 0)
+
+    async def incr(self, key: str) -> int:
+        self.counters[key] = self.counters.get(key, 0) + 1
+        return self.counters[key]
+
+class RedisCache:
+    def __init__(self, url: str, ttl: int):
+        self.client = redis_asyncio.from_url(url)
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes):
+        await self.client.set(key, value, ex=self.ttl)
+
+    async def delete(self, key: str):
+        await self.client.delete(key)
+
+    async def counter(self, key: str) -> int:
+        return int(await self.client.get(key) or 0)
+
+    async def incr(self, key: str) -> int:
+        return await self.client.incr(key)
+
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+if CACHE_REDIS_URL and redis_asyncio is None:
+    raise RuntimeError("CACHE_REDIS_URL is set but the redis package is not installed")
+response_cache = RedisCache(CACHE_REDIS_URL, CACHE_TTL_SECONDS) if CACHE_REDIS_URL else MemoryCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+
 # Models
 class User(SQLModel, table=True):
     __table_args__ = (UniqueConstraint("username"),)
@@ -35,26 +273,46 @@ class User(SQLModel, table=True):
     password: str  # hashed
     preferences: Optional[str] = None  # JSON string
 
+class JobStatusEnum(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
 class Plan(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     topics: str
     content: str
+    topics_key: Optional[str] = Field(default=None, index=True)  # normalized topics
+    created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+
+class PlanJob(SQLModel, table=True):
+    id: str = Field(primary_key=True)  # uuid hex
+    topics_key: str = Field(index=True)
+    status: JobStatusEnum = Field(default=JobStatusEnum.pending)
+    progress: float = 0.0  # 0..1
+    plan_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
 
 class Resume(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int
+    user_id: int = Field(index=True)
     file_name: str
     file_url: str
     uploaded_at: Optional[str] = Field(default=None)
+    size: Optional[int] = None  # bytes
+    sha256: Optional[str] = Field(default=None, index=True)
 
 class Skill(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int
+    user_id: int = Field(index=True)
     skill_name: str
 
 class Experience(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int
+    user_id: int = Field(index=True)
     title: str
     company: str
     location: Optional[str] = None
@@ -66,21 +324,53 @@ class Experience(SQLModel, table=True):
 
 class StudySet(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int
+    user_id: int = Field(index=True)
     title: str
     description: Optional[str] = None
     created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
 
 class StudyFile(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    study_set_id: int
+    study_set_id: int = Field(index=True, foreign_key="studyset.id", ondelete="CASCADE")
     file_name: str
     file_url: str
     uploaded_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+    size: Optional[int] = None  # bytes
+    sha256: Optional[str] = Field(default=None, index=True)
+
+class ExtractionJob(SQLModel, table=True):
+    # one row per file; re-queued when the file's content hash changes
+    id: Optional[int] = Field(default=None, primary_key=True)
+    study_file_id: int = Field(unique=True, foreign_key="studyfile.id", ondelete="CASCADE")
+    sha256: Optional[str] = None  # content the job was queued for
+    status: JobStatusEnum = Field(default=JobStatusEnum.pending, index=True)
+    attempts: int = 0
+    error: Optional[str] = None
+    chunk_count: int = 0
+    created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+
+class FileChunk(SQLModel, table=True):
+    __table_args__ = (Index("ix_filechunk_file_chunk", "study_file_id", "chunk_index"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    study_file_id: int = Field(foreign_key="studyfile.id", ondelete="CASCADE")
+    chunk_index: int
+    page_start: int  # 1-based
+    page_end: int
+    char_start: int  # offsets into the extracted document text
+    char_end: int
+    content: str
+
+class UploadSession(SQLModel, table=True):
+    id: str = Field(primary_key=True)  # uuid hex, also names the partial file
+    file_name: str
+    size: int  # expected total bytes
+    received: int = 0
+    created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
 
 class ChatThread(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    study_set_id: int = Field(unique=True)
+    study_set_id: int = Field(unique=True, foreign_key="studyset.id", ondelete="CASCADE")
     created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
 
 class SenderEnum(str, Enum):
@@ -88,12 +378,47 @@ class SenderEnum(str, Enum):
     gpt = "gpt"
 
 class ChatMessage(SQLModel, table=True):
+    # keyset pagination walks (created_at, id) inside a single thread
+    __table_args__ = (Index("ix_chatmessage_thread_created_id", "thread_id", "created_at", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
-    thread_id: int
+    thread_id: int = Field(foreign_key="chatthread.id", ondelete="CASCADE")
     sender: SenderEnum  # ✅ now SQLModel can understand it
     content: str
     created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
 
+class Flashcard(SQLModel, table=True):
+    __table_args__ = (Index("ix_flashcard_set_id", "study_set_id", "id"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    study_set_id: int = Field(foreign_key="studyset.id", ondelete="CASCADE")
+    front: str
+    back: str
+    created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+
+class FlashcardState(SQLModel, table=True):
+    # scheduling state, one row per card; the due queues are read from these indexes
+    __table_args__ = (
+        Index("ix_flashcardstate_set_due", "study_set_id", "due_at", "card_id"),
+        Index("ix_flashcardstate_user_due", "user_id", "due_at", "card_id"),
+    )
+    card_id: int = Field(primary_key=True, foreign_key="flashcard.id", ondelete="CASCADE")
+    study_set_id: int
+    user_id: int
+    due_at: datetime
+    interval_days: float = 0.0
+    ease: float = 2.5
+    repetitions: int = 0  # successful reviews in a row
+    lapses: int = 0
+    last_reviewed_at: Optional[datetime] = None
+
+class FlashcardReview(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    card_id: int = Field(index=True, foreign_key="flashcard.id", ondelete="CASCADE")
+    user_id: int
+    grade: int  # 0-5, SM-2 scale
+    reviewed_at: datetime
+    interval_days: float  # interval chosen by this review
+    ease: float
+
 # App setup
 app = FastAPI()
 
@@ -105,138 +430,1079 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Instrumentation
+# Request latency, DB work per request, upload throughput and pool checkout wait,
+# exported at /metrics in Prometheus text format. Requests slower than
+# SLOW_REQUEST_SECONDS are logged with their SQL, for a sampled fraction of them.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+THROUGHPUT_BUCKETS = (1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8)
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))  # same statement, one request
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))  # 0 disables the slow log
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv("SLOW_REQUEST_SAMPLE_RATE", "0.1"))
+slow_request_log = logging.getLogger("lessin.slow_requests")
+
+class Metric:
+    def __init__(self, name: str, help_text: str, kind: str):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.lock = threading.Lock()  # uploads are recorded from worker threads
+
+    @staticmethod
+    def label_text(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+        parts = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text, "counter")
+        self.values: Dict[tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] += amount
+
+    def render(self) -> List[str]:
+        with self.lock:
+            return self.header() + [f"{self.name}{self.label_text(k)} {v}" for k, v in self.values.items()]
+
+class Histogram(Metric):
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        super().__init__(name, help_text, "histogram")
+        self.buckets = buckets
+        self.series: Dict[tuple, list] = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self.lock:
+            for key, (counts, total, count) in self.series.items():
+                for bound, n in zip(self.buckets, counts):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{self.label_text(key, le)} {n}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{self.label_text(key, le)} {count}")
+                lines.append(f"{self.name}_sum{self.label_text(key)} {total}")
+                lines.append(f"{self.name}_count{self.label_text(key)} {count}")
+        return lines
+
+http_requests = Counter("lessin_http_requests_total", "HTTP requests by route and status.")
+http_latency = Histogram("lessin_http_request_duration_seconds", "HTTP request latency.", LATENCY_BUCKETS)
+db_queries_per_request = Histogram("lessin_db_queries_per_request", "SQL statements issued per request.", QUERY_COUNT_BUCKETS)
+db_time_per_request = Histogram("lessin_db_time_per_request_seconds", "Time spent in SQL per request.", LATENCY_BUCKETS)
+n_plus_one_requests = Counter("lessin_n_plus_one_requests_total", "Requests that repeated one statement N_PLUS_ONE_THRESHOLD+ times.")
+upload_bytes = Counter("lessin_upload_bytes_total", "Bytes received through upload routes.")
+upload_throughput = Histogram("lessin_upload_throughput_bytes_per_second", "Upload write throughput.", THROUGHPUT_BUCKETS)
+pool_checkout_wait = Histogram("lessin_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", LATENCY_BUCKETS)
+METRICS = [
+    http_requests, http_latency, db_queries_per_request, db_time_per_request,
+    n_plus_one_requests, upload_bytes, upload_throughput, pool_checkout_wait,
+]
+
+class RequestStats:
+    def __init__(self, keep_sql: bool):
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.statement_counts: Dict[str, int] = defaultdict(int)
+        self.sql: Optional[List[Tuple[str, float]]] = [] if keep_sql else None
+
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_request_stats.get()
+    if stats is None:
+        return
+    stats.query_count += 1
+    stats.query_seconds += elapsed
+    stats.statement_counts[statement] += 1
+    if stats.sql is not None and len(stats.sql) < 100:
+        stats.sql.append((statement, elapsed))
+
+def record_upload(nbytes: int, seconds: float):
+    upload_bytes.inc(nbytes)
+    if seconds > 0:
+        upload_throughput.observe(nbytes / seconds)
+
+class MetricsMiddleware:
+    # plain ASGI middleware so streaming responses pass through untouched
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        keep_sql = SLOW_REQUEST_SECONDS > 0 and random.random() < SLOW_REQUEST_SAMPLE_RATE
+        stats = RequestStats(keep_sql)
+        token = current_request_stats.set(stats)
+        status = 500
+        t0 = time.perf_counter()
 
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - t0
+            current_request_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            http_requests.inc(method=method, route=path, status=str(status))
+            http_latency.observe(elapsed, method=method, route=path)
+            db_queries_per_request.observe(stats.query_count, route=path)
+            db_time_per_request.observe(stats.query_seconds, route=path)
+            repeated = max(stats.statement_counts.values(), default=0)
+            if repeated >= N_PLUS_ONE_THRESHOLD:
+                n_plus_one_requests.inc(route=path)
+            if stats.sql is not None and elapsed >= SLOW_REQUEST_SECONDS:
+                slow_request_log.warning(json.dumps({
+                    "method": method,
+                    "route": path,
+                    "status": status,
+                    "seconds": round(elapsed, 4),
+                    "query_count": stats.query_count,
+                    "query_seconds": round(stats.query_seconds, 4),
+                    "sql": [{"statement": sql, "seconds": round(t, 4)} for sql, t in stats.sql],
+                }))
+
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics")
+async def metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+def ensure_columns(conn):
+    # create_all skips tables that already exist, so add new nullable columns to them
+    inspector = inspect(conn)
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+
+def ensure_indexes(conn):
+    # create_all skips tables that already exist, so add new indexes to them explicitly
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def ensure_foreign_keys(conn):
+    # create_all skips tables that already exist, so add their cascading foreign keys.
+    # NOT VALID skips checking old rows (the GC job removes orphans). SQLite cannot add
+    # constraints to an existing table; there the GC job is what cleans up.
+    if conn.dialect.name != "postgresql":
+        return
+    inspector = inspect(conn)
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {tuple(fk["constrained_columns"]) for fk in inspector.get_foreign_keys(table.name)}
+        for fk in table.foreign_keys:
+            if (fk.parent.name,) in existing:
+                continue
+            conn.execute(text(
+                f'ALTER TABLE "{table.name}" ADD CONSTRAINT "{table.name}_{fk.parent.name}_fkey" '
+                f'FOREIGN KEY ("{fk.parent.name}") REFERENCES "{fk.column.table.name}" ("{fk.column.name}") '
+                f'ON DELETE {fk.ondelete} NOT VALID'
+            ))
+
+@app.on_event("startup")
+async def on_startup():
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(ensure_columns)
+        await conn.run_sync(ensure_indexes)
+        await conn.run_sync(ensure_foreign_keys)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(UPLOAD_PARTIAL_DIR, exist_ok=True)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await engine.dispose()
+
+# Upload storage
+# Files are stored once under their SHA-256 (uploads/<sha256><ext>), so identical
+# uploads share a blob and same-named uploads from different users never collide.
+UPLOAD_DIR = "uploads"
+UPLOAD_PARTIAL_DIR = os.getenv("UPLOAD_PARTIAL_DIR", "uploads_partial")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+
+def move_to_blob(tmp_path: str, sha256: str, file_name: str, keep_source: bool = False) -> str:
+    blob_name = f"{sha256}{os.path.splitext(file_name)[1].lower()}"
+    if not CONTENT_HASH_NAME.match(blob_name):
+        # "a.pdf~", "report.v2-final": without the extension the name is still a
+        # content hash, so the blob is cached as immutable and can be collected
+        blob_name = sha256
+    blob_path = os.path.join(UPLOAD_DIR, blob_name)
+    try:
+        os.utime(blob_path)  # already stored; a fresh mtime keeps the GC off it
+        if not keep_source:
+            os.remove(tmp_path)
+    except FileNotFoundError:
+        if not keep_source:
+            os.replace(tmp_path, blob_path)
+        else:
+            try:
+                os.link(tmp_path, blob_path)
+            except FileExistsError:
+                pass  # stored by a concurrent upload of the same content
+            os.utime(blob_path)
+    return f"/uploads/{blob_name}"
+
+def write_blob(src, file_name: str) -> Tuple[str, int, str]:
+    # copy in chunks while hashing, then move the temp file to its content address
+    digest = hashlib.sha256()
+    size = 0
+    started = time.perf_counter()
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_PARTIAL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="File too large")
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    record_upload(size, time.perf_counter() - started)
+    sha256 = digest.hexdigest()
+    return sha256, size, move_to_blob(tmp_path, sha256, file_name)
+
+def finish_partial(upload_id: str) -> Tuple[str, int, str]:
+    partial_path = os.path.join(UPLOAD_PARTIAL_DIR, upload_id)
+    digest = hashlib.sha256()
+    size = 0
+    with open(partial_path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    sha256 = digest.hexdigest()
+    return sha256, size, partial_path
+
+async def receive_upload(session: AsyncSession, file: Optional[UploadFile], upload_id: Optional[str]):
+    """Store either a direct upload or a completed chunked upload; returns (file_name, sha256, size, url)."""
+    if (file is None) == (upload_id is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of 'file' or 'upload_id'")
+    if file is not None:
+        sha256, size, file_url = await run_in_threadpool(write_blob, file.file, file.filename)
+        return file.filename, sha256, size, file_url
+
+    upload = await session.get(UploadSession, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if upload.received != upload.size:
+        raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "received": upload.received, "size": upload.size})
+    file_name = upload.file_name
+    try:
+        sha256, size, partial_path = await run_in_threadpool(finish_partial, upload_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    # the session is claimed with a conditional DELETE, so of two requests finishing
+    # the same upload (a client retry) one wins and the other gets 404. The partial
+    # file is linked into place rather than moved: if this request's transaction
+    # rolls back, the session and its data are both still there for a retry. Once
+    # the delete commits, the GC removes the leftover partial file.
+    claimed = await session.execute(
+        delete(UploadSession).where(UploadSession.id == upload_id, UploadSession.received == UploadSession.size)
+    )
+    if claimed.rowcount != 1:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    file_url = await run_in_threadpool(move_to_blob, partial_path, sha256, file_name, True)
+    return file_name, sha256, size, file_url
+
+@app.post("/uploads/sessions")
+async def create_upload_session(file_name: str = Form(...), size: int = Form(...)):
+    if size <= 0 or size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413 if size > 0 else 400, detail="Invalid upload size")
+    upload = UploadSession(id=uuid.uuid4().hex, file_name=file_name, size=size)
+    open(os.path.join(UPLOAD_PARTIAL_DIR, upload.id), "wb").close()
+    async with async_session() as session:
+        session.add(upload)
+        await session.commit()
+    return {"upload_id": upload.id, "received": 0, "size": size, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+@app.get("/uploads/sessions/{upload_id}")
+async def get_upload_session(upload_id: str):
+    async with async_session() as session:
+        upload = await session.get(UploadSession, upload_id)
+        if not upload:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return {"upload_id": upload.id, "received": upload.received, "size": upload.size}
+
+def write_chunk(tmp_path: str, partial_path: str, offset: int, length: int):
+    # written at the claimed offset rather than appended, so commit order does not matter
+    with open(tmp_path, "rb") as src, open(partial_path, "r+b") as out:
+        out.seek(offset)
+        for block in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b""):
+            out.write(block)
+        out.truncate(offset + length)  # drop bytes from an earlier unrecorded write
+
+@app.put("/uploads/sessions/{upload_id}")
+async def put_upload_chunk(request: Request, upload_id: str, offset: int = Query(...)):
+    # raw request body is stored at `offset`; after a dropped connection the client
+    # reads `received` back from GET and resumes from there. The body is spooled to a
+    # temp file and the byte range is then claimed with a conditional UPDATE, so of two
+    # PUTs at the same offset (a retry after a timeout) one wins and the other gets 409.
+    async with async_session() as session:
+        upload = await session.get(UploadSession, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if offset != upload.received:
+        raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "received": upload.received})
+
+    started = time.perf_counter()
+    length = 0
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_PARTIAL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            try:
+                async for chunk in request.stream():
+                    if offset + length + len(chunk) > upload.size:
+                        raise HTTPException(status_code=413, detail="Chunk exceeds declared upload size")
+                    await run_in_threadpool(tmp.write, chunk)
+                    length += len(chunk)
+            except ClientDisconnect:
+                pass
+
+        received = offset + length
+        async with async_session() as session:
+            claimed = await session.execute(
+                update(UploadSession)
+                .where(UploadSession.id == upload_id, UploadSession.received == offset)
+                .values(received=received)
+            )
+            if claimed.rowcount != 1:
+                current = await session.get(UploadSession, upload_id)
+                if not current:
+                    raise HTTPException(status_code=404, detail="Upload not found")
+                raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "received": current.received})
+            # bytes land before the commit, so a completed upload is never read half-written
+            await run_in_threadpool(write_chunk, tmp_path, os.path.join(UPLOAD_PARTIAL_DIR, upload_id), offset, length)
+            await session.commit()
+    finally:
+        os.remove(tmp_path)
+    record_upload(length, time.perf_counter() - started)
+    return {"upload_id": upload.id, "received": received, "size": upload.size, "complete": received == upload.size}
+
+# Text extraction pipeline
+# Uploaded study files are queued in the ExtractionJob table and picked up by
+# in-process workers, which store the text as page-tagged FileChunk rows. The
+# queue lives in the database, so several server processes can share it. A job
+# whose worker is cancelled (shutdown, redeploy) goes straight back to the
+# queue; one whose process died is requeued by idle workers once it has been
+# running for EXTRACT_STALE_SECONDS.
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "1"))  # 0 disables the in-process workers
+EXTRACT_POLL_SECONDS = float(os.getenv("EXTRACT_POLL_SECONDS", "5"))
+EXTRACT_MAX_ATTEMPTS = int(os.getenv("EXTRACT_MAX_ATTEMPTS", "3"))
+EXTRACT_STALE_SECONDS = int(os.getenv("EXTRACT_STALE_SECONDS", "600"))
+CHUNK_CHARS = 1200
+CHUNK_OVERLAP = 200
+extraction_wakeup = asyncio.Event()
+extraction_tasks: List[asyncio.Task] = []
+
+def upload_path(file_url: str) -> str:
+    return os.path.join(UPLOAD_DIR, file_url.removeprefix("/uploads/"))
+
+def extract_pages(path: str) -> List[str]:
+    media_type = mimetypes.guess_type(path)[0] or ""
+    if media_type == "application/pdf":
+        if PdfReader is None:
+            raise RuntimeError("pypdf is not installed")
+        pages = [page.extract_text() or "" for page in PdfReader(path).pages]
+    elif is_text_like(media_type):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pages = [f.read()]
+    else:
+        raise ValueError(f"Unsupported file type: {media_type or 'unknown'}")
+    return [" ".join(page.split()) for page in pages]
+
+def chunk_pages(pages: List[str], size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[dict]:
+    # pages are joined into one document; each chunk records the pages it spans
+    page_starts = []
+    text = ""
+    for page in pages:
+        page_starts.append(len(text))
+        text += page + "\n"
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            space = text.rfind(" ", start + size // 2, end)
+            end = space if space > 0 else end
+        content = text[start:end].strip()
+        if content:
+            chunks.append({
+                "chunk_index": len(chunks),
+                "page_start": bisect.bisect_right(page_starts, start),
+                "page_end": bisect.bisect_right(page_starts, end - 1),
+                "char_start": start,
+                "char_end": end,
+                "content": content,
+            })
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+async def enqueue_extraction(session: AsyncSession, study_file: StudyFile):
+    """Queue a file unless its current content is already extracted or queued."""
+    job = (await session.exec(select(ExtractionJob).where(ExtractionJob.study_file_id == study_file.id))).first()
+    if job and job.sha256 == study_file.sha256 and job.status != JobStatusEnum.failed:
+        return job
+    job = job or ExtractionJob(study_file_id=study_file.id)
+    job.sha256 = study_file.sha256
+    job.status = JobStatusEnum.pending
+    job.attempts = 0
+    job.error = None
+    job.updated_at = datetime.utcnow()
+    session.add(job)
+    return job
+
+async def claim_extraction_job() -> Optional[int]:
+    async with async_session() as session:
+        candidates = (await session.exec(
+            select(ExtractionJob.id).where(ExtractionJob.status == JobStatusEnum.pending).order_by(ExtractionJob.id).limit(5)
+        )).all()
+        for job_id in candidates:
+            # conditional update, so only one worker (in any process) wins the job
+            result = await session.execute(
+                update(ExtractionJob)
+                .where(ExtractionJob.id == job_id, ExtractionJob.status == JobStatusEnum.pending)
+                .values(status=JobStatusEnum.running, attempts=ExtractionJob.attempts + 1, updated_at=datetime.utcnow())
+            )
+            await session.commit()
+            if result.rowcount == 1:
+                return job_id
+    return None
+
+async def release_extraction_job(job_id: int):
+    # back to the queue without counting the attempt; only while still ours
+    async with async_session() as session:
+        await session.execute(
+            update(ExtractionJob)
+            .where(ExtractionJob.id == job_id, ExtractionJob.status == JobStatusEnum.running)
+            .values(status=JobStatusEnum.pending, attempts=ExtractionJob.attempts - 1, updated_at=datetime.utcnow())
+        )
+        await session.commit()
+
+async def requeue_stale_extraction_jobs():
+    # jobs left running by a worker that died without releasing them
+    stale_before = datetime.utcnow() - timedelta(seconds=EXTRACT_STALE_SECONDS)
+    async with async_session() as session:
+        await session.execute(
+            update(ExtractionJob)
+            .where(ExtractionJob.status == JobStatusEnum.running, ExtractionJob.updated_at < stale_before)
+            .values(status=JobStatusEnum.pending)
+        )
+        await session.commit()
+
+async def run_extraction_job(job_id: int):
+    try:
+        await extract_job(job_id)
+    except asyncio.CancelledError:
+        # shut down mid-job (e.g. a redeploy): requeue it now rather than after EXTRACT_STALE_SECONDS
+        await asyncio.shield(release_extraction_job(job_id))
+        raise
+
+async def extract_job(job_id: int):
+    async with async_session() as session:
+        job = await session.get(ExtractionJob, job_id)
+        if not job:
+            return  # its file was deleted after the job was claimed
+        study_file = await session.get(StudyFile, job.study_file_id)
+        try:
+            if not study_file:
+                raise LookupError("File was deleted")
+            pages = await run_in_threadpool(extract_pages, upload_path(study_file.file_url))
+            chunks = await run_in_threadpool(chunk_pages, pages)
+        except Exception as exc:
+            job.status = JobStatusEnum.pending if job.attempts < EXTRACT_MAX_ATTEMPTS and not isinstance(exc, (LookupError, ValueError)) else JobStatusEnum.failed
+            job.error = f"{type(exc).__name__}: {exc}"
+        else:
+            await session.execute(delete(FileChunk).where(FileChunk.study_file_id == study_file.id))
+            if chunks:
+                await session.execute(insert(FileChunk), [{"study_file_id": study_file.id, **c} for c in chunks])
+            job.status = JobStatusEnum.done
+            job.error = None
+            job.chunk_count = len(chunks)
+        job.updated_at = datetime.utcnow()
+        session.add(job)
+        await session.commit()
+    if job.status == JobStatusEnum.done:
+        try:
+            await sync_vector_index(study_file.study_set_id)
+        except Exception:
+            logging.getLogger(__name__).exception("Vector index update failed")
+
+async def extraction_worker():
+    while True:
+        extraction_wakeup.clear()
+        try:
+            job_id = await claim_extraction_job()
+            if job_id is not None:
+                await run_extraction_job(job_id)
+                continue
+            await requeue_stale_extraction_jobs()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.getLogger(__name__).exception("Extraction worker error")
+        try:
+            await asyncio.wait_for(extraction_wakeup.wait(), EXTRACT_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
 
 @app.on_event("startup")
-def on_startup():
-    SQLModel.metadata.create_all(engine)
+async def start_extraction_workers():
+    await requeue_stale_extraction_jobs()
+    async with async_session() as session:
+        # backfill files that were never extracted or whose content changed
+        missing = (await session.exec(
+            select(StudyFile)
+            .outerjoin(ExtractionJob, ExtractionJob.study_file_id == StudyFile.id)
+            .where(or_(ExtractionJob.id == None, ExtractionJob.sha256 != StudyFile.sha256))  # noqa: E711
+        )).all()
+        for study_file in missing:
+            await enqueue_extraction(session, study_file)
+        await session.commit()
+    for _ in range(EXTRACT_WORKERS):
+        extraction_tasks.append(asyncio.create_task(extraction_worker()))
+
+@app.on_event("shutdown")
+async def stop_extraction_workers():
+    for task in extraction_tasks:
+        task.cancel()
+    await asyncio.gather(*extraction_tasks, return_exceptions=True)
+    extraction_tasks.clear()
 
 # Auth routes
 @app.post("/signup")
-def signup(username: str = Form(...), email: str = Form(...), password: str = Form(...)):
-    with Session(engine) as session:
-        existing_user = session.exec(select(User).where(User.username == username)).first()
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Username already exists")
-        user = User(username=username, email=email, password=hash_password(password))
+async def signup(request: Request, username: str = Form(...), email: str = Form(...), password: str = Form(...)):
+    throttle((f"ip:{client_ip(request)}", LOGIN_MAX_PER_IP))
+    async with async_session() as session:
+        existing_user = (await session.exec(select(User).where(User.username == username))).first()
+    if existing_user:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    hashed = await run_hashing(hash_password, password)
+    async with async_session() as session:
+        user = User(username=username, email=email, password=hashed)
         session.add(user)
-        session.commit()
-        session.refresh(user)
+        try:
+            await session.commit()
+        except IntegrityError:
+            # taken while the password was being hashed
+            raise HTTPException(status_code=400, detail="Username already exists")
+        await session.refresh(user)
         return {"id": user.id, "username": user.username, "email": user.email}
 
 @app.post("/login")
-def login(username: str = Form(...), password: str = Form(...)):
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == username)).first()
-        if not user or not verify_password(password, user.password):
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        return {"message": "Login successful", "user_id": user.id}
+async def login(request: Request, username: str = Form(...), password: str = Form(...)):
+    throttle((f"ip:{client_ip(request)}", LOGIN_MAX_PER_IP), (f"user:{username}", LOGIN_MAX_PER_USERNAME))
+    # no connection is held while the hash is checked
+    async with async_session() as session:
+        user = (await session.exec(select(User).where(User.username == username))).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await run_hashing(verify_and_update_password, password, user.password)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        async with async_session() as session:
+            await session.execute(update(User).where(User.id == user.id).values(password=new_hash))
+            await session.commit()
+    return {"message": "Login successful", "user_id": user.id}
+
+@app.on_event("shutdown")
+async def stop_hash_pool():
+    global hash_pool
+    if hash_pool is not None:
+        hash_pool.shutdown(cancel_futures=True)
+        hash_pool = None
 
 @app.post("/survey")
-def submit_survey(user_id: int = Form(...), preferences: str = Form(...)):
+async def submit_survey(user_id: int = Form(...), preferences: str = Form(...)):
     try:
         json.loads(preferences)
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON in preferences")
-    with Session(engine) as session:
-        user = session.get(User, user_id)
+    async with async_session() as session:
+        user = await session.get(User, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         user.preferences = preferences
         session.add(user)
-        session.commit()
+        await session.commit()
         return {"message": "Preferences saved", "user": {"id": user.id, "username": user.username, "preferences": json.loads(user.preferences)}}
 
-@app.post("/plans/generate")
-async def generate_plan(topics: str = Form(...)):
-    content = f"Plan steps for {topics}"
-    with Session(engine) as session:
-        plan = Plan(topics=topics, content=content)
-        session.add(plan)
-        session.commit()
-        session.refresh(plan)
-        return {"plan": plan}
+# Plan generation
+# Submitting topics returns a job. Identical in-flight submissions share one job,
+# and finished plans are served from a normalized-topics cache (memory, then
+# recent Plan rows) until PLAN_CACHE_TTL_SECONDS passes.
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", "86400"))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "1000"))
+PLAN_JOB_STALE_SECONDS = int(os.getenv("PLAN_JOB_STALE_SECONDS", "300"))
+PLAN_STUB_DELAY = float(os.getenv("PLAN_STUB_DELAY", "1.0"))  # seconds per plan
+plan_cache = MemoryCache(PLAN_CACHE_MAX_ENTRIES, PLAN_CACHE_TTL_SECONDS)
+plan_inflight: Dict[str, str] = {}  # topics_key -> job id, for this process
+plan_tasks: Set[asyncio.Task] = set()
+plan_submit_lock = asyncio.Lock()
+
+def normalize_topics(topics: str) -> str:
+    parts = {" ".join(t.split()).lower() for t in re.split(r"[,;\n]", topics)}
+    return ", ".join(sorted(p for p in parts if p))
+
+async def stub_plan_generator(topics: List[str], report: Callable[[float], Awaitable[None]]) -> str:
+    # offline stand-in for a model; takes PLAN_STUB_DELAY seconds in total
+    steps = []
+    for i, topic in enumerate(topics, start=1):
+        await asyncio.sleep(PLAN_STUB_DELAY / len(topics))
+        steps.append(f"{i}. Study {topic}")
+        await report(i / len(topics))
+    return f"Plan steps for {', '.join(topics)}\n" + "\n".join(steps)
+
+plan_generator: Callable[[List[str], Callable[[float], Awaitable[None]]], Awaitable[str]] = stub_plan_generator
+
+async def cached_plan(topics_key: str) -> Optional[dict]:
+    cached = await plan_cache.get(topics_key)
+    if cached is not None:
+        return json.loads(cached)
+    async with async_session() as session:
+        plan = (await session.exec(
+            select(Plan)
+            .where(Plan.topics_key == topics_key, Plan.created_at > datetime.utcnow() - timedelta(seconds=PLAN_CACHE_TTL_SECONDS))
+            .order_by(Plan.id.desc())
+        )).first()
+    if not plan:
+        return None
+    plan_json = jsonable_encoder(plan)
+    await plan_cache.set(topics_key, json.dumps(plan_json).encode())
+    return plan_json
+
+async def fail_plan_jobs(condition, error: str):
+    # only unfinished jobs; one that completed in the meantime keeps its plan
+    async with async_session() as session:
+        await session.execute(
+            update(PlanJob)
+            .where(condition, PlanJob.status.in_([JobStatusEnum.pending, JobStatusEnum.running]))
+            .values(status=JobStatusEnum.failed, error=error, updated_at=datetime.utcnow())
+        )
+        await session.commit()
+
+async def run_plan_job(job_id: str, topics: str, topics_key: str):
+    async def report(progress: float):
+        async with async_session() as session:
+            await session.execute(
+                update(PlanJob).where(PlanJob.id == job_id).values(progress=progress, updated_at=datetime.utcnow())
+            )
+            await session.commit()
+
+    try:
+        await report(0.0)
+        async with async_session() as session:
+            await session.execute(update(PlanJob).where(PlanJob.id == job_id).values(status=JobStatusEnum.running))
+            await session.commit()
+        content = await plan_generator(topics_key.split(", "), report)
+        async with async_session() as session:
+            plan = Plan(topics=topics, content=content, topics_key=topics_key)
+            session.add(plan)
+            await session.flush()
+            await session.execute(
+                update(PlanJob).where(PlanJob.id == job_id)
+                .values(status=JobStatusEnum.done, progress=1.0, plan_id=plan.id, updated_at=datetime.utcnow())
+            )
+            await session.commit()
+        await plan_cache.set(topics_key, json.dumps(jsonable_encoder(plan)).encode())
+    except asyncio.CancelledError:
+        # shutdown: nothing will finish this job, so don't leave it for new submissions to join
+        await asyncio.shield(fail_plan_jobs(PlanJob.id == job_id, "Interrupted"))
+        raise
+    except Exception as exc:
+        logging.getLogger(__name__).exception("Plan generation failed")
+        async with async_session() as session:
+            await session.execute(
+                update(PlanJob).where(PlanJob.id == job_id)
+                .values(status=JobStatusEnum.failed, error=f"{type(exc).__name__}: {exc}", updated_at=datetime.utcnow())
+            )
+            await session.commit()
+    finally:
+        plan_inflight.pop(topics_key, None)
+
+def plan_job_status(job: PlanJob, plan: Optional[dict] = None) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "progress": job.progress,
+        "plan": plan,
+        "error": job.error,
+    }
+
+def cached_plan_status(plan: dict) -> dict:
+    return {"job_id": None, "status": JobStatusEnum.done, "progress": 1.0, "plan": plan, "error": None}
+
+@app.post("/plans/generate", status_code=202)
+async def generate_plan(response: Response, topics: str = Form(...)):
+    topics_key = normalize_topics(topics)
+    if not topics_key:
+        raise HTTPException(status_code=400, detail="No topics given")
+    plan = await cached_plan(topics_key)
+    if plan is not None:
+        response.status_code = 200
+        return cached_plan_status(plan)
+
+    async with plan_submit_lock:
+        # the lock makes find-or-create atomic within this process
+        job_id = plan_inflight.get(topics_key)
+        if job_id is None:
+            # a job may have finished while this request waited for the lock
+            plan = await cached_plan(topics_key)
+            if plan is not None:
+                response.status_code = 200
+                return cached_plan_status(plan)
+        async with async_session() as session:
+            if job_id is None:
+                # another process may already be generating the same plan
+                fresh_after = datetime.utcnow() - timedelta(seconds=PLAN_JOB_STALE_SECONDS)
+                job = (await session.exec(
+                    select(PlanJob).where(
+                        PlanJob.topics_key == topics_key,
+                        PlanJob.status.in_([JobStatusEnum.pending, JobStatusEnum.running]),
+                        PlanJob.updated_at > fresh_after,
+                    )
+                )).first()
+                if job:
+                    return plan_job_status(job)
+                job = PlanJob(id=uuid.uuid4().hex, topics_key=topics_key)
+                session.add(job)
+                await session.commit()
+                plan_inflight[topics_key] = job.id
+                task = asyncio.create_task(run_plan_job(job.id, topics, topics_key))
+                plan_tasks.add(task)
+                task.add_done_callback(plan_tasks.discard)
+                return plan_job_status(job)
+            return plan_job_status(await session.get(PlanJob, job_id))
+
+@app.get("/plans/jobs/{job_id}")
+async def get_plan_job(job_id: str):
+    async with async_session() as session:
+        job = await session.get(PlanJob, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        stale = job.updated_at < datetime.utcnow() - timedelta(seconds=PLAN_JOB_STALE_SECONDS)
+        if stale and job.status in (JobStatusEnum.pending, JobStatusEnum.running) and job_id not in plan_inflight.values():
+            # no progress for the whole stale window and not running here: its process is gone
+            await fail_plan_jobs(PlanJob.id == job_id, "Interrupted")
+            await session.refresh(job)
+        plan = await session.get(Plan, job.plan_id) if job.plan_id else None
+        return plan_job_status(job, jsonable_encoder(plan) if plan else None)
+
+@app.on_event("startup")
+async def fail_stale_plan_jobs():
+    # jobs whose process died stop getting progress updates
+    await fail_plan_jobs(PlanJob.updated_at < datetime.utcnow() - timedelta(seconds=PLAN_JOB_STALE_SECONDS), "Interrupted")
+
+@app.on_event("shutdown")
+async def stop_plan_jobs():
+    for task in plan_tasks:
+        task.cancel()
+    await asyncio.gather(*plan_tasks, return_exceptions=True)
+
+# Batch writes
+# JSON bodies of create/update/delete operations, applied in one transaction
+# with set-based INSERT ... RETURNING, UPDATE by primary key and DELETE ... IN.
+# Each operation gets its own result; unknown ids are reported, not fatal.
+BATCH_MAX_OPERATIONS = 500
+
+class SkillData(SQLModel):
+    skill_name: str
+
+class ExperienceData(SQLModel):
+    title: Optional[str] = None
+    company: Optional[str] = None
+    location: Optional[str] = None
+    type: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    bullets: Optional[List[str]] = None
+
+class StudyFileData(SQLModel):
+    file_name: Optional[str] = None
+    upload_id: Optional[str] = None  # completed chunked upload, for creates
+
+class SkillOp(SQLModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    data: Optional[SkillData] = None
+
+class ExperienceOp(SQLModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    data: Optional[ExperienceData] = None
+
+class FlashcardData(SQLModel):
+    front: Optional[str] = None
+    back: Optional[str] = None
+
+class StudyFileOp(SQLModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    data: Optional[StudyFileData] = None
+
+class FlashcardOp(SQLModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    data: Optional[FlashcardData] = None
+
+class SkillBatch(SQLModel):
+    user_id: int
+    operations: List[SkillOp]
+
+class ExperienceBatch(SQLModel):
+    user_id: int
+    operations: List[ExperienceOp]
+
+class StudyFileBatch(SQLModel):
+    study_set_id: int
+    operations: List[StudyFileOp]
+
+class FlashcardBatch(SQLModel):
+    study_set_id: int
+    operations: List[FlashcardOp]
+
+def batch_error(index: int, detail: str, id: Optional[int] = None) -> dict:
+    return {"index": index, "status": "error", "id": id, "detail": detail}
+
+async def apply_batch(session: AsyncSession, model, scope, operations, create_row, update_row) -> List[dict]:
+    """Apply operations on `model` rows matching `scope`.
+
+    create_row/update_row turn an operation into column values, or return an
+    error string for that item.
+    """
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_OPERATIONS} operations per batch")
+    results: List[Optional[dict]] = [None] * len(operations)
+    ids = {op.id for op in operations if op.op != "create" and op.id is not None}
+    owned = set((await session.exec(select(model.id).where(scope, model.id.in_(ids)))).all()) if ids else set()
+
+    creates, updates, deletes = [], [], []
+    for i, op in enumerate(operations):
+        if op.op != "create" and op.id not in owned:
+            results[i] = batch_error(i, "Not found", op.id)
+            continue
+        row = await create_row(op) if op.op == "create" else update_row(op) if op.op == "update" else {}
+        if isinstance(row, str):
+            results[i] = batch_error(i, row, op.id)
+        elif op.op == "create":
+            creates.append((i, row))
+        elif op.op == "update":
+            updates.append((i, {"id": op.id, **row}))
+        else:
+            deletes.append(i)
+
+    if creates:
+        new_ids = (await session.execute(
+            insert(model).returning(model.id, sort_by_parameter_order=True), [row for _, row in creates]
+        )).scalars().all()
+        for (i, _), new_id in zip(creates, new_ids):
+            results[i] = {"index": i, "status": "created", "id": new_id}
+    changed = [row for _, row in updates if len(row) > 1]  # rows with more than the id
+    if changed:
+        await session.execute(update(model), changed)
+    for i, row in updates:
+        results[i] = {"index": i, "status": "updated", "id": row["id"]}
+    if deletes:
+        await session.execute(delete(model).where(scope, model.id.in_([operations[i].id for i in deletes])))
+        for i in deletes:
+            results[i] = {"index": i, "status": "deleted", "id": operations[i].id}
+    return results
 
 # CRUD routes
+# Skills, resumes and experiences are read with one UNION ALL query; each branch
+# fills its own columns and leaves the rest NULL.
+PROFILE_COLUMNS = [
+    ("id", Integer), ("name", String), ("company", String), ("location", String), ("type", String),
+    ("start_date", Date), ("end_date", Date), ("bullets", String), ("file_url", String),
+    ("uploaded_at", String), ("size", Integer), ("sha256", String),
+]
+
+def profile_branch(kind: str, **columns):
+    values = [literal(kind).label("kind")]
+    for name, column_type in PROFILE_COLUMNS:
+        column = columns.get(name)
+        values.append((column if column is not None else cast(null(), column_type)).label(name))
+    return values
+
+def profile_query(user_id: int):
+    return union_all(
+        select(*profile_branch("skill", id=Skill.id, name=Skill.skill_name)).where(Skill.user_id == user_id),
+        select(*profile_branch(
+            "resume", id=Resume.id, name=Resume.file_name, file_url=Resume.file_url,
+            uploaded_at=Resume.uploaded_at, size=Resume.size, sha256=Resume.sha256,
+        )).where(Resume.user_id == user_id),
+        select(*profile_branch(
+            "experience", id=Experience.id, name=Experience.title, company=Experience.company,
+            location=Experience.location, type=Experience.type, start_date=Experience.start_date,
+            end_date=Experience.end_date, bullets=Experience.bullets,
+        )).where(Experience.user_id == user_id),
+    ).order_by("kind", "id")
+
+async def load_profile(user_id: int) -> dict:
+    profile = {"skills": [], "resumes": [], "experiences": []}
+    async with async_session() as session:
+        rows = (await session.execute(profile_query(user_id))).mappings().all()
+    for row in rows:
+        if row["kind"] == "skill":
+            profile["skills"].append({"id": row["id"], "user_id": user_id, "skill_name": row["name"]})
+        elif row["kind"] == "resume":
+            profile["resumes"].append({
+                "id": row["id"], "user_id": user_id, "file_name": row["name"], "file_url": row["file_url"],
+                "uploaded_at": row["uploaded_at"], "size": row["size"], "sha256": row["sha256"],
+            })
+        else:
+            profile["experiences"].append({
+                "id": row["id"], "user_id": user_id, "title": row["name"], "company": row["company"],
+                "location": row["location"], "type": row["type"], "start_date": row["start_date"],
+                "end_date": row["end_date"], "bullets": row["bullets"],
+            })
+    return profile
+
+# Cached profiles are keyed by a per-user generation that every write bumps. A
+# read that overlapped a write stores its (possibly stale) body under the old
+# generation, where no later read looks.
+async def invalidate_profile(user_id: int):
+    generation = await response_cache.incr(f"profile-gen:{user_id}")
+    await response_cache.delete(f"profile:{user_id}:{generation - 1}")
+
 @app.get("/profile/{user_id}")
-def get_user_profile(user_id: int):
-    with Session(engine) as session:
-        skills = session.exec(select(Skill).where(Skill.user_id == user_id)).all()
-        resumes = session.exec(select(Resume).where(Resume.user_id == user_id)).all()
-        experiences = session.exec(select(Experience).where(Experience.user_id == user_id)).all()
-        return {
-            "skills": skills,
-            "resumes": resumes,
-            "experiences": experiences
-        }
+async def get_user_profile(request: Request, user_id: int):
+    generation = await response_cache.counter(f"profile-gen:{user_id}")
+    key = f"profile:{user_id}:{generation}"
+    cached = await response_cache.get(key)
+    if cached is None:
+        body = json.dumps(jsonable_encoder(await load_profile(user_id))).encode()
+        cached = hashlib.sha256(body).hexdigest()[:32].encode() + b"\n" + body
+        if await response_cache.counter(f"profile-gen:{user_id}") == generation:
+            await response_cache.set(key, cached)
+    etag_value, body = cached.split(b"\n", 1)
+    headers = {"ETag": f'"{etag_value.decode()}"', "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.post("/skills")
-def add_skill(user_id: int = Form(...), skill_name: str = Form(...)):
-    with Session(engine) as session:
+async def add_skill(user_id: int = Form(...), skill_name: str = Form(...)):
+    async with async_session() as session:
         skill = Skill(user_id=user_id, skill_name=skill_name)
         session.add(skill)
-        session.commit()
-        session.refresh(skill)
-        return skill
+        await session.commit()
+        await session.refresh(skill)
+    await invalidate_profile(user_id)
+    return skill
 
 @app.post("/resumes")
-def add_resume(user_id: int = Form(...), file: UploadFile = File(...)):
-    local_path = f"uploads/{file.filename}"
-    with open(local_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    file_url = f"/uploads/{file.filename}"
-
-    with Session(engine) as session:
-        user = session.get(User, user_id)
+async def add_resume(
+    user_id: int = Form(...),
+    file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None)  # id of a completed chunked upload
+):
+    async with async_session() as session:
+        user = await session.get(User, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        resume = Resume(user_id=user_id, file_name=file.filename, file_url=file_url)
+        file_name, sha256, size, file_url = await receive_upload(session, file, upload_id)
+        resume = Resume(user_id=user_id, file_name=file_name, file_url=file_url, size=size, sha256=sha256)
         session.add(resume)
-        session.commit()
-        session.refresh(resume)
-        return resume
+        await session.commit()
+        await session.refresh(resume)
+    await invalidate_profile(user_id)
+    return resume
 
 
 @app.delete("/skills/{skill_id}")
-def delete_skill(skill_id: int):
-    with Session(engine) as session:
-        skill = session.get(Skill, skill_id)
+async def delete_skill(skill_id: int):
+    async with async_session() as session:
+        skill = await session.get(Skill, skill_id)
         if not skill:
             raise HTTPException(status_code=404, detail="Skill not found")
-        session.delete(skill)
-        session.commit()
-        return {"message": "Skill deleted"}
+        await session.delete(skill)
+        await session.commit()
+    await invalidate_profile(skill.user_id)
+    return {"message": "Skill deleted"}
 
 @app.post("/skills/batch")
-def update_skills(user_id: int = Form(...), skills_json: str = Form(...)):
-    new_skills = json.loads(skills_json)
-    with Session(engine) as session:
-        existing_skills = session.exec(select(Skill).where(Skill.user_id == user_id)).all()
-        existing_names = {s.skill_name for s in existing_skills}
-        new_names = set(new_skills)
-        for skill in existing_skills:
-            if skill.skill_name not in new_names:
-                session.delete(skill)
-        for name in new_names:
-            if name not in existing_names:
-                session.add(Skill(user_id=user_id, skill_name=name))
-        session.commit()
+async def update_skills(user_id: int = Form(...), skills_json: str = Form(...)):
+    new_names = set(json.loads(skills_json))
+    async with async_session() as session:
+        existing_names = set((await session.exec(select(Skill.skill_name).where(Skill.user_id == user_id))).all())
+        await session.execute(delete(Skill).where(Skill.user_id == user_id, Skill.skill_name.not_in(new_names)))
+        missing = sorted(new_names - existing_names)
+        if missing:
+            await session.execute(insert(Skill), [{"user_id": user_id, "skill_name": name} for name in missing])
+        await session.commit()
+    await invalidate_profile(user_id)
     return {"message": "Skills updated"}
 
+@app.post("/skills/bulk")
+async def bulk_skills(batch: SkillBatch):
+    async def create_row(op):
+        if op.data is None:
+            return "data is required"
+        return {"user_id": batch.user_id, "skill_name": op.data.skill_name}
+
+    def update_row(op):
+        if op.data is None:
+            return "data is required"
+        return {"skill_name": op.data.skill_name}
+
+    async with async_session() as session:
+        results = await apply_batch(session, Skill, Skill.user_id == batch.user_id, batch.operations, create_row, update_row)
+        await session.commit()
+    await invalidate_profile(batch.user_id)
+    return {"results": results}
+
 @app.delete("/resumes/{resume_id}")
-def delete_resume(resume_id: int):
-    with Session(engine) as session:
-        resume = session.get(Resume, resume_id)
+async def delete_resume(resume_id: int):
+    async with async_session() as session:
+        resume = await session.get(Resume, resume_id)
         if not resume:
             raise HTTPException(status_code=404, detail="Resume not found")
-        session.delete(resume)
-        session.commit()
-        return {"message": "Resume deleted"}
+        await session.delete(resume)
+        await session.commit()
+    await invalidate_profile(resume.user_id)
+    return {"message": "Resume deleted"}
     
 @app.post("/experiences")
-def add_experience(
+async def add_experience(
     user_id: int = Form(...),
     title: str = Form(...),
     company: str = Form(...),
@@ -246,7 +1512,7 @@ def add_experience(
     end_date: Optional[date] = Form(None),
     bullets_json: Optional[str] = Form("[]")
 ):
-    with Session(engine) as session:
+    async with async_session() as session:
         experience = Experience(
             user_id=user_id,
             title=title,
@@ -258,23 +1524,25 @@ def add_experience(
             bullets=bullets_json  # just store the raw JSON string
         )
         session.add(experience)
-        session.commit()
-        session.refresh(experience)
-        return experience
+        await session.commit()
+        await session.refresh(experience)
+    await invalidate_profile(experience.user_id)
+    return experience
     
 @app.delete("/experiences/{experience_id}")
-def delete_experience(experience_id: int):
-    with Session(engine) as session:
-        experience = session.get(Experience, experience_id)
+async def delete_experience(experience_id: int):
+    async with async_session() as session:
+        experience = await session.get(Experience, experience_id)
         if not experience:
             raise HTTPException(status_code=404, detail="Experience not found")
-        session.delete(experience)
-        session.commit()
-        return {"message": "Experience deleted"}
+        await session.delete(experience)
+        await session.commit()
+    await invalidate_profile(experience.user_id)
+    return {"message": "Experience deleted"}
 
 
 @app.put("/experiences/{experience_id}")
-def update_experience(
+async def update_experience(
     experience_id: int = Path(...),
     title: str = Form(...),
     company: str = Form(...),
@@ -284,8 +1552,8 @@ def update_experience(
     end_date: Optional[date] = Form(None),
     bullets_json: Optional[str] = Form("[]")  # accept updated bullet points
 ):
-    with Session(engine) as session:
-        experience = session.get(Experience, experience_id)
+    async with async_session() as session:
+        experience = await session.get(Experience, experience_id)
         if not experience:
             raise HTTPException(status_code=404, detail="Experience not found")
 
@@ -298,117 +1566,1239 @@ def update_experience(
         experience.bullets = bullets_json  # update JSON-encoded bullets
 
         session.add(experience)
-        session.commit()
-        session.refresh(experience)
-        return experience
+        await session.commit()
+        await session.refresh(experience)
+    await invalidate_profile(experience.user_id)
+    return experience
+
+def experience_values(data: ExperienceData, partial: bool) -> dict:
+    values = data.model_dump(exclude_unset=partial)
+    if "bullets" in values:
+        values["bullets"] = json.dumps(values["bullets"] or [])  # stored as a JSON string
+    return values
+
+@app.post("/experiences/bulk")
+async def bulk_experiences(batch: ExperienceBatch):
+    async def create_row(op):
+        if op.data is None or not op.data.title or not op.data.company:
+            return "title and company are required"
+        return {"user_id": batch.user_id, **experience_values(op.data, partial=False)}
+
+    def update_row(op):
+        if op.data is None:
+            return "data is required"
+        values = experience_values(op.data, partial=True)
+        if any(field in values and not values[field] for field in ("title", "company")):
+            return "title and company cannot be empty"
+        return values
+
+    async with async_session() as session:
+        results = await apply_batch(
+            session, Experience, Experience.user_id == batch.user_id, batch.operations, create_row, update_row
+        )
+        await session.commit()
+    await invalidate_profile(batch.user_id)
+    return {"results": results}
 
 # StudySet CRUD
 @app.post("/studysets")
-def create_study_set(user_id: int = Form(...), title: str = Form(...), description: Optional[str] = Form(None)):
-    with Session(engine) as session:
+async def create_study_set(user_id: int = Form(...), title: str = Form(...), description: Optional[str] = Form(None)):
+    async with async_session() as session:
         study_set = StudySet(user_id=user_id, title=title, description=description)
         session.add(study_set)
-        session.commit()
-        session.refresh(study_set)
+        await session.commit()
+        await session.refresh(study_set)
         return study_set
 
 @app.get("/studysets/{user_id}")
-def get_study_sets(user_id: int):
-    with Session(engine) as session:
-        sets = session.exec(select(StudySet).where(StudySet.user_id == user_id)).all()
+async def get_study_sets(user_id: int):
+    async with async_session() as session:
+        sets = (await session.exec(select(StudySet).where(StudySet.user_id == user_id))).all()
         return sets
 
 @app.put("/studysets/{set_id}")
-def update_study_set(set_id: int, title: str = Form(...), description: Optional[str] = Form(None)):
-    with Session(engine) as session:
-        s = session.get(StudySet, set_id)
+async def update_study_set(set_id: int, title: str = Form(...), description: Optional[str] = Form(None)):
+    async with async_session() as session:
+        s = await session.get(StudySet, set_id)
         if not s:
             raise HTTPException(status_code=404, detail="StudySet not found")
         s.title = title
         s.description = description
-        session.commit()
+        await session.commit()
         return s
 
 @app.delete("/studysets/{set_id}")
-def delete_study_set(set_id: int):
-    with Session(engine) as session:
-        s = session.get(StudySet, set_id)
+async def delete_study_set(set_id: int):
+    async with async_session() as session:
+        s = await session.get(StudySet, set_id)
         if not s:
             raise HTTPException(status_code=404, detail="StudySet not found")
-        session.delete(s)
-        session.commit()
+        await session.delete(s)
+        await session.commit()
         return {"message": "StudySet deleted"}
 
 # StudyFile CRUD
 @app.post("/studyfiles")
-def upload_study_file(
+async def upload_study_file(
     study_set_id: int = Form(...),
-    file: UploadFile = File(...)
+    file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None)  # id of a completed chunked upload
 ):
-    # Save file locally
-    local_path = f"uploads/{file.filename}"
-    with open(local_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    file_url = f"/uploads/{file.filename}"  # adjust if serving files via a static route
-
-    with Session(engine) as session:
-        study_set = session.get(StudySet, study_set_id)
+    async with async_session() as session:
+        study_set = await session.get(StudySet, study_set_id)
         if not study_set:
             raise HTTPException(status_code=404, detail="StudySet not found")
-        new_file = StudyFile(study_set_id=study_set_id, file_name=file.filename, file_url=file_url)
+        file_name, sha256, size, file_url = await receive_upload(session, file, upload_id)
+        new_file = StudyFile(study_set_id=study_set_id, file_name=file_name, file_url=file_url, size=size, sha256=sha256)
         session.add(new_file)
-        session.commit()
-        session.refresh(new_file)
+        await session.flush()
+        await enqueue_extraction(session, new_file)
+        await session.commit()
+        await session.refresh(new_file)
+        extraction_wakeup.set()
         return new_file
 
+@app.post("/studyfiles/batch")
+async def upload_study_files(study_set_id: int = Form(...), files: List[UploadFile] = File(...)):
+    if len(files) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_OPERATIONS} files per batch")
+    async with async_session() as session:
+        study_set = await session.get(StudySet, study_set_id)
+        if not study_set:
+            raise HTTPException(status_code=404, detail="StudySet not found")
+        stored = await asyncio.gather(*(run_in_threadpool(write_blob, f.file, f.filename) for f in files))
+        rows = [
+            {"study_set_id": study_set_id, "file_name": f.filename, "file_url": url, "size": size, "sha256": sha256}
+            for f, (sha256, size, url) in zip(files, stored)
+        ]
+        new_files = (await session.scalars(
+            insert(StudyFile).returning(StudyFile, sort_by_parameter_order=True), rows
+        )).all()
+        await session.execute(insert(ExtractionJob), [{"study_file_id": f.id, "sha256": f.sha256} for f in new_files])
+        await session.commit()
+    extraction_wakeup.set()
+    return new_files
+
+@app.post("/studyfiles/bulk")
+async def bulk_study_files(batch: StudyFileBatch):
+    async with async_session() as session:
+        study_set = await session.get(StudySet, batch.study_set_id)
+        if not study_set:
+            raise HTTPException(status_code=404, detail="StudySet not found")
+
+        seen_uploads: Set[str] = set()
+
+        async def create_row(op):
+            if op.data is None or not op.data.upload_id:
+                return "upload_id is required"
+            if op.data.upload_id in seen_uploads:
+                return "upload_id is already used in this batch"
+            seen_uploads.add(op.data.upload_id)
+            try:
+                file_name, sha256, size, file_url = await receive_upload(session, None, op.data.upload_id)
+            except HTTPException as exc:
+                return exc.detail if isinstance(exc.detail, str) else exc.detail.get("message", "Upload failed")
+            return {
+                "study_set_id": batch.study_set_id, "file_name": op.data.file_name or file_name,
+                "file_url": file_url, "size": size, "sha256": sha256,
+            }
+
+        def update_row(op):
+            if op.data is None or not op.data.file_name:
+                return "file_name is required"
+            return {"file_name": op.data.file_name}
+
+        results = await apply_batch(
+            session, StudyFile, StudyFile.study_set_id == batch.study_set_id, batch.operations, create_row, update_row
+        )
+        created = [r["id"] for r in results if r["status"] == "created"]
+        if created:
+            new_files = (await session.exec(select(StudyFile).where(StudyFile.id.in_(created)))).all()
+            await session.execute(insert(ExtractionJob), [{"study_file_id": f.id, "sha256": f.sha256} for f in new_files])
+        await session.commit()
+    if created:
+        extraction_wakeup.set()
+    return {"results": results}
+
 @app.get("/studyfiles/{study_set_id}")
-def get_study_files(study_set_id: int):
-    with Session(engine) as session:
-        files = session.exec(select(StudyFile).where(StudyFile.study_set_id == study_set_id)).all()
+async def get_study_files(study_set_id: int):
+    async with async_session() as session:
+        files = (await session.exec(select(StudyFile).where(StudyFile.study_set_id == study_set_id))).all()
         return files
 
 @app.delete("/studyfiles/{file_id}")
-def delete_study_file(file_id: int):
-    with Session(engine) as session:
-        f = session.get(StudyFile, file_id)
+async def delete_study_file(file_id: int):
+    async with async_session() as session:
+        f = await session.get(StudyFile, file_id)
         if not f:
             raise HTTPException(status_code=404, detail="File not found")
-        session.delete(f)
-        session.commit()
+        await session.delete(f)
+        await session.commit()
         return {"message": "File deleted"}
 
+@app.get("/studyfiles/{file_id}/extraction")
+async def get_extraction_status(file_id: int):
+    async with async_session() as session:
+        job = (await session.exec(select(ExtractionJob).where(ExtractionJob.study_file_id == file_id))).first()
+        if not job:
+            raise HTTPException(status_code=404, detail="No extraction job for this file")
+        return {
+            "study_file_id": file_id,
+            "status": job.status,
+            "attempts": job.attempts,
+            "error": job.error,
+            "chunk_count": job.chunk_count,
+            "updated_at": job.updated_at,
+        }
+
+# Flashcards
+# Cards belong to a study set; their SM-2 scheduling state lives in
+# FlashcardState, indexed by (set, due_at) and (user, due_at), so the next N due
+# cards come from an index range scan however large the deck is. Reviews are
+# submitted in batches and applied in one transaction.
+FLASHCARD_PAGE_DEFAULT = 100
+FLASHCARD_PAGE_MAX = 500
+FLASHCARD_DUE_DEFAULT = 20
+FLASHCARD_DUE_MAX = 200
+SM2_MIN_EASE = 1.3
+
+class FlashcardReviewItem(SQLModel):
+    card_id: int
+    grade: int = Field(ge=0, le=5)  # 0-2 forgotten, 3 hard, 4 good, 5 easy
+    reviewed_at: Optional[datetime] = None  # when answered offline; defaults to now
+
+class FlashcardReviewBatch(SQLModel):
+    user_id: int
+    reviews: List[FlashcardReviewItem]
+
+def utc_naive(value: datetime) -> datetime:
+    # stored timestamps are naive UTC (datetime.utcnow)
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+def sm2_schedule(state: dict, grade: int, now: datetime) -> dict:
+    """Next scheduling state after one review (SuperMemo-2)."""
+    ease = max(SM2_MIN_EASE, state["ease"] + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    if grade < 3:
+        repetitions, interval, lapses = 0, 1.0, state["lapses"] + 1
+    else:
+        repetitions, lapses = state["repetitions"] + 1, state["lapses"]
+        interval = 1.0 if repetitions == 1 else 6.0 if repetitions == 2 else round(state["interval_days"] * ease)
+    return {
+        "ease": ease,
+        "repetitions": repetitions,
+        "lapses": lapses,
+        "interval_days": interval,
+        "last_reviewed_at": now,
+        "due_at": now + timedelta(days=interval),
+    }
+
+def due_card(card: Flashcard, state: FlashcardState) -> dict:
+    return {
+        "id": card.id,
+        "study_set_id": card.study_set_id,
+        "front": card.front,
+        "back": card.back,
+        "due_at": state.due_at,
+        "interval_days": state.interval_days,
+        "repetitions": state.repetitions,
+    }
+
+@app.get("/flashcards/due")
+async def get_due_flashcards(
+    user_id: Optional[int] = None,  # due across all of the user's sets
+    study_set_id: Optional[int] = None,  # or in one set
+    limit: int = FLASHCARD_DUE_DEFAULT,
+):
+    if (user_id is None) == (study_set_id is None):
+        raise HTTPException(status_code=400, detail="Pass exactly one of 'user_id' or 'study_set_id'")
+    limit = max(1, min(limit, FLASHCARD_DUE_MAX))
+    scope = FlashcardState.user_id == user_id if user_id is not None else FlashcardState.study_set_id == study_set_id
+    async with async_session() as session:
+        rows = (await session.execute(
+            select(Flashcard, FlashcardState)
+            .join(FlashcardState, FlashcardState.card_id == Flashcard.id)
+            .where(scope, FlashcardState.due_at <= datetime.utcnow())
+            .order_by(FlashcardState.due_at, FlashcardState.card_id)
+            .limit(limit)
+        )).all()
+    return [due_card(card, state) for card, state in rows]
+
+@app.get("/flashcards/{study_set_id}")
+async def get_flashcards(study_set_id: int, after: Optional[int] = None, limit: int = FLASHCARD_PAGE_DEFAULT):
+    # keyset pages by card id, so large decks are fetched a page at a time
+    limit = max(1, min(limit, FLASHCARD_PAGE_MAX))
+    query = select(Flashcard).where(Flashcard.study_set_id == study_set_id)
+    if after is not None:
+        query = query.where(Flashcard.id > after)
+    async with async_session() as session:
+        return (await session.exec(query.order_by(Flashcard.id).limit(limit))).all()
+
+@app.post("/flashcards/bulk")
+async def bulk_flashcards(batch: FlashcardBatch):
+    async def create_row(op):
+        if op.data is None or not op.data.front or not op.data.back:
+            return "front and back are required"
+        return {"study_set_id": batch.study_set_id, "front": op.data.front, "back": op.data.back}
+
+    def update_row(op):
+        if op.data is None:
+            return "data is required"
+        return op.data.model_dump(exclude_unset=True, exclude_none=True)
+
+    async with async_session() as session:
+        study_set = await session.get(StudySet, batch.study_set_id)
+        if not study_set:
+            raise HTTPException(status_code=404, detail="StudySet not found")
+        results = await apply_batch(
+            session, Flashcard, Flashcard.study_set_id == batch.study_set_id, batch.operations, create_row, update_row
+        )
+        now = datetime.utcnow()
+        created = [r["id"] for r in results if r["status"] == "created"]
+        if created:  # new cards are due straight away
+            await session.execute(insert(FlashcardState), [
+                {"card_id": card_id, "study_set_id": study_set.id, "user_id": study_set.user_id, "due_at": now}
+                for card_id in created
+            ])
+        deleted = [r["id"] for r in results if r["status"] == "deleted"]
+        if deleted:
+            await session.execute(delete(FlashcardState).where(FlashcardState.card_id.in_(deleted)))
+        await session.commit()
+    return {"results": results}
+
+@app.post("/flashcards/reviews")
+async def submit_flashcard_reviews(batch: FlashcardReviewBatch):
+    if len(batch.reviews) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_OPERATIONS} reviews per batch")
+    now = datetime.utcnow()
+    card_ids = {review.card_id for review in batch.reviews}
+    async with async_session() as session:
+        states = {
+            state.card_id: state.model_dump()
+            for state in (await session.exec(
+                select(FlashcardState).where(FlashcardState.user_id == batch.user_id, FlashcardState.card_id.in_(card_ids))
+            )).all()
+        } if card_ids else {}
+        results: List[Optional[dict]] = [None] * len(batch.reviews)
+        logs = []
+        answered = [
+            min(utc_naive(review.reviewed_at), now) if review.reviewed_at else now for review in batch.reviews
+        ]
+        # a card reviewed twice in one batch is scheduled in answer order
+        for i in sorted(range(len(batch.reviews)), key=lambda i: answered[i]):
+            review = batch.reviews[i]
+            if review.card_id not in states:
+                results[i] = batch_error(i, "Not found", review.card_id)
+                continue
+            reviewed_at = answered[i]
+            state = states[review.card_id]
+            state.update(sm2_schedule(state, review.grade, reviewed_at))
+            logs.append({
+                "card_id": review.card_id,
+                "user_id": batch.user_id,
+                "grade": review.grade,
+                "reviewed_at": reviewed_at,
+                "interval_days": state["interval_days"],
+                "ease": state["ease"],
+            })
+            results[i] = {"index": i, "status": "reviewed", "id": review.card_id, "due_at": state["due_at"]}
+        if logs:
+            reviewed = {log["card_id"] for log in logs}
+            await session.execute(update(FlashcardState), [states[card_id] for card_id in reviewed])
+            await session.execute(insert(FlashcardReview), logs)
+        await session.commit()
+    return {"results": results}
+
 # ChatThread and ChatMessage
 @app.get("/chats/thread/{study_set_id}")
-def get_or_create_thread(study_set_id: int):
-    with Session(engine) as session:
-        thread = session.exec(select(ChatThread).where(ChatThread.study_set_id == study_set_id)).first()
+async def get_or_create_thread(study_set_id: int):
+    async with async_session() as session:
+        thread = (await session.exec(select(ChatThread).where(ChatThread.study_set_id == study_set_id))).first()
         if thread:
             return thread
+        if not await session.get(StudySet, study_set_id):
+            raise HTTPException(status_code=404, detail="StudySet not found")
         new_thread = ChatThread(study_set_id=study_set_id)
         session.add(new_thread)
-        session.commit()
-        session.refresh(new_thread)
+        await session.commit()
+        await session.refresh(new_thread)
         return new_thread
 
+CHAT_PAGE_DEFAULT = 50
+CHAT_PAGE_MAX = 200
+
 @app.get("/chats/messages/{thread_id}")
-def get_chat_messages(thread_id: int):
-    with Session(engine) as session:
-        messages = session.exec(select(ChatMessage).where(ChatMessage.thread_id == thread_id)).all()
-        return messages
+async def get_chat_messages(
+    thread_id: int,
+    before: Optional[int] = None,  # message id: page of older messages
+    after: Optional[int] = None,  # message id: page of newer messages
+    since: Optional[datetime] = None,  # only messages created after this time
+    limit: int = CHAT_PAGE_DEFAULT,
+):
+    if before is not None and (after is not None or since is not None):
+        raise HTTPException(status_code=400, detail="'before' cannot be combined with 'after' or 'since'")
+    if after is not None and since is not None:
+        raise HTTPException(status_code=400, detail="Use either 'after' or 'since', not both")
+    limit = max(1, min(limit, CHAT_PAGE_MAX))
+
+    async with async_session() as session:
+        query = select(ChatMessage).where(ChatMessage.thread_id == thread_id)
+        cursor_id = before if before is not None else after
+        if cursor_id is not None:
+            cursor = await session.get(ChatMessage, cursor_id)
+            if not cursor or cursor.thread_id != thread_id:
+                raise HTTPException(status_code=404, detail="Cursor message not found")
+            if before is not None:
+                query = query.where(tuple_(ChatMessage.created_at, ChatMessage.id) < (cursor.created_at, cursor.id))
+            else:
+                query = query.where(tuple_(ChatMessage.created_at, ChatMessage.id) > (cursor.created_at, cursor.id))
+        elif since is not None:
+            query = query.where(ChatMessage.created_at > utc_naive(since))
+
+        if after is not None or since is not None:
+            # oldest first, so the client can append and continue from the last id
+            query = query.order_by(ChatMessage.created_at, ChatMessage.id).limit(limit)
+            return (await session.exec(query)).all()
+
+        # latest page (or the page before the cursor), returned in chronological order
+        query = query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit)
+        messages = (await session.exec(query)).all()
+        return list(reversed(messages))
 
 @app.post("/chats/messages")
-def add_chat_message(thread_id: int = Form(...), sender: str = Form(...), content: str = Form(...)):
+async def add_chat_message(
+    thread_id: int = Form(...),
+    sender: str = Form(...),
+    content: str = Form(...),
+    reply: bool = Form(False)  # stream a gpt reply to subscribers of the thread
+):
     if sender not in ("user", "gpt"):
         raise HTTPException(status_code=400, detail="Sender must be 'user' or 'gpt'")
-    with Session(engine) as session:
+    async with async_session() as session:
+        if not await session.get(ChatThread, thread_id):
+            raise HTTPException(status_code=404, detail="Thread not found")
         message = ChatMessage(thread_id=thread_id, sender=sender, content=content)
         session.add(message)
-        session.commit()
-        session.refresh(message)
-        return message
+        await session.commit()
+        await session.refresh(message)
+    publish_chat_event(thread_id, "message", jsonable_encoder(message), message.id)
+    if reply and sender == "user":
+        task = asyncio.create_task(stream_reply(thread_id, content))
+        reply_tasks.add(task)
+        task.add_done_callback(reply_tasks.discard)
+    return message
+
+# Chat streaming
+# Open threads hold one Server-Sent Events connection each. New messages and
+# partial reply tokens are fanned out in-process; a reply is persisted once,
+# when it finishes. Clients that fall behind are disconnected and catch up
+# from the database using Last-Event-ID on reconnect.
+CHAT_STREAM_HEARTBEAT_SECONDS = 15
+CHAT_STREAM_QUEUE_SIZE = 1000
+CHAT_STUB_TOKEN_DELAY = float(os.getenv("CHAT_STUB_TOKEN_DELAY", "0.02"))
+CHAT_GROUNDING_K = 3
+chat_subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+reply_tasks: Set[asyncio.Task] = set()
+
+def publish_chat_event(thread_id: int, event: str, data: dict, event_id: Optional[int] = None):
+    for queue in list(chat_subscribers.get(thread_id, ())):
+        try:
+            queue.put_nowait((event, data, event_id))
+        except asyncio.QueueFull:
+            chat_subscribers[thread_id].discard(queue)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)  # tells the stream to close
 
-from fastapi.staticfiles import StaticFiles
+def sse_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
 
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+async def stub_reply_tokens(prompt: str, passages: List[dict]) -> AsyncIterator[str]:
+    # offline stand-in for a model: echoes the prompt word by word
+    grounding = f" ({len(passages)} passages from your files)" if passages else ""
+    words = f"(stub reply{grounding}) You asked: {prompt}".split(" ")
+    for i, word in enumerate(words):
+        await asyncio.sleep(CHAT_STUB_TOKEN_DELAY)
+        yield word if i == 0 else " " + word
+
+# swap in a real model client; passages come from the thread's study set
+reply_generator: Callable[[str, List[dict]], AsyncIterator[str]] = stub_reply_tokens
+
+async def stream_reply(thread_id: int, prompt: str):
+    reply_id = uuid.uuid4().hex
+    parts = []
+    try:
+        async with async_session() as session:
+            thread = await session.get(ChatThread, thread_id)
+        passages = await retrieve_passages(thread.study_set_id, [prompt], CHAT_GROUNDING_K) if thread else [[]]
+        async for token in reply_generator(prompt, passages[0]):
+            parts.append(token)
+            publish_chat_event(thread_id, "delta", {"reply_id": reply_id, "content": token})
+    except Exception:
+        # a cut-off reply is not saved, where it would read as complete; live
+        # viewers drop the deltas they got for this reply_id
+        logging.getLogger(__name__).exception("Reply generation failed")
+        publish_chat_event(thread_id, "error", {"reply_id": reply_id, "detail": "Reply generation failed"})
+        return
+    async with async_session() as session:
+        message = ChatMessage(thread_id=thread_id, sender=SenderEnum.gpt, content="".join(parts))
+        session.add(message)
+        await session.commit()
+        await session.refresh(message)
+    publish_chat_event(thread_id, "message", {**jsonable_encoder(message), "reply_id": reply_id}, message.id)
+
+@app.get("/chats/stream/{thread_id}")
+async def stream_chat(request: Request, thread_id: int, after: Optional[int] = None):
+    last_id = after
+    if last_id is None and request.headers.get("last-event-id", "").isdigit():
+        last_id = int(request.headers["last-event-id"])
+
+    # subscribe before reading the backlog so nothing falls between the two
+    queue = asyncio.Queue(maxsize=CHAT_STREAM_QUEUE_SIZE)
+    chat_subscribers[thread_id].add(queue)
+
+    def unsubscribe():
+        chat_subscribers[thread_id].discard(queue)
+        if not chat_subscribers[thread_id]:
+            del chat_subscribers[thread_id]
+
+    async with async_session() as session:
+        thread = await session.get(ChatThread, thread_id)
+        if not thread:
+            unsubscribe()
+            raise HTTPException(status_code=404, detail="Thread not found")
+
+    async def backlog_page(after_id: int) -> List[ChatMessage]:
+        async with async_session() as session:
+            return (await session.exec(
+                select(ChatMessage)
+                .where(ChatMessage.thread_id == thread_id, ChatMessage.id > after_id)
+                .order_by(ChatMessage.id)
+                .limit(CHAT_PAGE_MAX)
+            )).all()
+
+    async def events():
+        try:
+            sent_id = last_id or 0
+            # page through everything missed since last_id, however long the gap
+            page = await backlog_page(sent_id) if last_id is not None else []
+            while page:
+                for message in page:
+                    yield sse_event("message", jsonable_encoder(message), message.id)
+                    sent_id = message.id
+                page = await backlog_page(sent_id) if len(page) == CHAT_PAGE_MAX else []
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), CHAT_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if item is None:
+                    return
+                event, data, event_id = item
+                if event_id is not None and event_id <= sent_id:
+                    continue  # already sent from the backlog
+                yield sse_event(event, data, event_id)
+        finally:
+            unsubscribe()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.on_event("shutdown")
+async def stop_chat_streams():
+    for task in reply_tasks:
+        task.cancel()
+    for queues in chat_subscribers.values():
+        for queue in queues:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+# Full-text search
+# SQLite uses FTS5 tables kept in sync by triggers; Postgres uses GIN indexes on
+# to_tsvector expressions, which it maintains itself. Either way the index is
+# updated in the same transaction as the row it covers. Chunk and message FTS
+# rows also index their file/thread id, so a search is scoped to the user's own
+# files and threads inside MATCH, before anything is ranked.
+SEARCH_KINDS = ("studyset", "file", "message")
+SEARCH_PAGE_MAX = 50
+SQLITE_FTS_TABLES = {
+    "studyset": ("title", "description"),
+    "filechunk": ("content", "study_file_id"),
+    "chatmessage": ("content", "thread_id"),
+}
+POSTGRES_TSVECTORS = {
+    "studyset": "to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))",
+    "filechunk": "to_tsvector('english', content)",
+    "chatmessage": "to_tsvector('english', content)",
+}
+search_backend: Optional[str] = None  # "fts5", "postgres", or None when unavailable
+
+def ensure_search_index(conn):
+    global search_backend
+    if conn.dialect.name == "postgresql":
+        for table, expression in POSTGRES_TSVECTORS.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_fts ON {table} USING gin ({expression})"))
+        search_backend = "postgres"
+        return
+    if conn.dialect.name != "sqlite":
+        return
+
+    for table, columns in SQLITE_FTS_TABLES.items():
+        fts = f"{table}_fts"
+        cols = ", ".join(columns)
+        new_cols = ", ".join(f"new.{c}" for c in columns)
+        old_cols = ", ".join(f"old.{c}" for c in columns)
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": fts}).first()
+        if exists and tuple(r[1] for r in conn.execute(text(f"PRAGMA table_info({fts})"))) != columns:
+            # indexed columns changed: rebuild the table and its triggers
+            for suffix in ("ai", "ad", "au"):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {fts}_{suffix}"))
+            conn.execute(text(f"DROP TABLE {fts}"))
+            exists = None
+        try:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', "
+                f"content_rowid='id', tokenize='porter unicode61')"
+            ))
+        except OperationalError:
+            logging.getLogger(__name__).warning("SQLite was built without FTS5; /search is disabled")
+            return
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+        ))
+        if not exists:
+            # index rows written before the FTS table existed
+            conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    search_backend = "fts5"
+
+@app.on_event("startup")
+async def setup_search():
+    async with engine.begin() as conn:
+        await conn.run_sync(ensure_search_index)
+
+def fts5_scoped(match: str, column: str, ids: List[int]) -> str:
+    # "content : (terms) AND thread_id : ("1" OR "2")", so only the user's rows are matched
+    return f'content : ({match}) AND {column} : (' + " OR ".join(f'"{i}"' for i in ids) + ")"
+
+def fts5_query(q: str) -> str:
+    # quote every term so user input can't break MATCH syntax; the last term is a prefix
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return ""
+    return " ".join(f'"{t}"' for t in terms[:-1]) + (" " if len(terms) > 1 else "") + f'"{terms[-1]}"*'
+
+FTS5_SEARCH_SQL = {
+    "studyset": """
+        SELECT 'studyset' AS kind, s.id AS id, s.id AS study_set_id, s.title AS title,
+               snippet(studyset_fts, -1, '<b>', '</b>', '…', 16) AS snippet, -bm25(studyset_fts) AS score
+        FROM studyset_fts JOIN studyset s ON s.id = studyset_fts.rowid
+        WHERE studyset_fts MATCH :q AND s.user_id = :user_id""",
+    "file": """
+        SELECT 'file' AS kind, c.id AS id, f.study_set_id AS study_set_id, f.file_name AS title,
+               snippet(filechunk_fts, 0, '<b>', '</b>', '…', 16) AS snippet, -bm25(filechunk_fts, 1.0, 0.0) AS score
+        FROM filechunk_fts JOIN filechunk c ON c.id = filechunk_fts.rowid JOIN studyfile f ON f.id = c.study_file_id
+        WHERE filechunk_fts MATCH :file_q""",
+    "message": """
+        SELECT 'message' AS kind, m.id AS id, t.study_set_id AS study_set_id, s.title AS title,
+               snippet(chatmessage_fts, 0, '<b>', '</b>', '…', 16) AS snippet, -bm25(chatmessage_fts, 1.0, 0.0) AS score
+        FROM chatmessage_fts JOIN chatmessage m ON m.id = chatmessage_fts.rowid
+        JOIN chatthread t ON t.id = m.thread_id JOIN studyset s ON s.id = t.study_set_id
+        WHERE chatmessage_fts MATCH :message_q""",
+}
+
+POSTGRES_SEARCH_SQL = {
+    "studyset": f"""
+        SELECT 'studyset' AS kind, s.id AS id, s.id AS study_set_id, s.title AS title,
+               coalesce(s.description, s.title) AS body, ts_rank({POSTGRES_TSVECTORS["studyset"]}, query) AS score
+        FROM studyset s, websearch_to_tsquery('english', :q) query
+        WHERE {POSTGRES_TSVECTORS["studyset"]} @@ query AND s.user_id = :user_id""",
+    "file": f"""
+        SELECT 'file' AS kind, c.id AS id, f.study_set_id AS study_set_id, f.file_name AS title,
+               c.content AS body, ts_rank({POSTGRES_TSVECTORS["filechunk"]}, query) AS score
+        FROM filechunk c JOIN studyfile f ON f.id = c.study_file_id, websearch_to_tsquery('english', :q) query
+        WHERE c.study_file_id IN (
+                  SELECT f2.id FROM studyfile f2 JOIN studyset s ON s.id = f2.study_set_id WHERE s.user_id = :user_id
+              ) AND {POSTGRES_TSVECTORS["filechunk"]} @@ query""",
+    "message": f"""
+        SELECT 'message' AS kind, m.id AS id, t.study_set_id AS study_set_id, s.title AS title,
+               m.content AS body, ts_rank({POSTGRES_TSVECTORS["chatmessage"]}, query) AS score
+        FROM chatmessage m JOIN chatthread t ON t.id = m.thread_id JOIN studyset s ON s.id = t.study_set_id,
+             websearch_to_tsquery('english', :q) query
+        WHERE m.thread_id IN (
+                  SELECT t2.id FROM chatthread t2 JOIN studyset s2 ON s2.id = t2.study_set_id WHERE s2.user_id = :user_id
+              ) AND {POSTGRES_TSVECTORS["chatmessage"]} @@ query""",
+}
+
+@app.get("/search")
+async def search(
+    user_id: int,
+    q: str = Query(..., min_length=1),
+    kinds: Optional[str] = None,  # comma-separated subset of SEARCH_KINDS
+    limit: int = 20,
+    offset: int = 0,
+):
+    if search_backend is None:
+        raise HTTPException(status_code=503, detail="Search is not available on this database")
+    selected = [k.strip() for k in kinds.split(",")] if kinds else list(SEARCH_KINDS)
+    if not selected or any(k not in SEARCH_KINDS for k in selected):
+        raise HTTPException(status_code=400, detail=f"kinds must be a subset of {', '.join(SEARCH_KINDS)}")
+    limit = max(1, min(limit, SEARCH_PAGE_MAX))
+    offset = max(0, offset)
+
+    params = {"q": q, "user_id": user_id, "limit": limit, "offset": offset}
+    if search_backend == "fts5":
+        match = fts5_query(q)
+        if not match:
+            return {"results": [], "limit": limit, "offset": offset}
+        params["q"] = match
+        async with async_session() as session:
+            if "file" in selected:
+                file_ids = (await session.exec(
+                    select(StudyFile.id).join(StudySet, StudySet.id == StudyFile.study_set_id).where(StudySet.user_id == user_id)
+                )).all()
+                params["file_q"] = fts5_scoped(match, "study_file_id", file_ids)
+            if "message" in selected:
+                thread_ids = (await session.exec(
+                    select(ChatThread.id).join(StudySet, StudySet.id == ChatThread.study_set_id).where(StudySet.user_id == user_id)
+                )).all()
+                params["message_q"] = fts5_scoped(match, "thread_id", thread_ids)
+        selected = [k for k in selected if k == "studyset" or (file_ids if k == "file" else thread_ids)]
+        if not selected:
+            return {"results": [], "limit": limit, "offset": offset}
+        union = " UNION ALL ".join(FTS5_SEARCH_SQL[k] for k in selected)
+        sql = f"SELECT * FROM ({union}) ORDER BY score DESC LIMIT :limit OFFSET :offset"
+    else:
+        union = " UNION ALL ".join(POSTGRES_SEARCH_SQL[k] for k in selected)
+        # headlines are only built for the rows on this page
+        sql = f"""
+            SELECT kind, id, study_set_id, title, score,
+                   ts_headline('english', body, websearch_to_tsquery('english', :q),
+                               'StartSel=<b>, StopSel=</b>, MaxWords=24, MinWords=8') AS snippet
+            FROM (SELECT * FROM ({union}) hits ORDER BY score DESC LIMIT :limit OFFSET :offset) page
+            ORDER BY score DESC"""
+
+    async with async_session() as session:
+        rows = (await session.execute(text(sql), params)).mappings().all()
+    return {"results": [dict(r) for r in rows], "limit": limit, "offset": offset}
+
+# Semantic retrieval
+# Each study set has an embedding index on disk: a float32 matrix (one row per
+# FileChunk, memory-mapped for search) and the row-aligned chunk ids, each
+# paired with a fingerprint of its file's sha256. SQLite hands a deleted row's
+# id to the next insert, so a chunk is identified by (id, fingerprint), never
+# by id alone. Indexes sync against the database by diffing those pairs. The
+# diff only runs when the set's stamp (chunk count and max id per file
+# content) changes, so a read on an up-to-date index costs one aggregate
+# query plus the matrix product.
+VECTOR_DIR = os.getenv("VECTOR_DIR", "vectors")
+VECTOR_CACHE_SETS = 64
+VECTOR_SEARCH_BLOCK = 16384  # rows scored per matmul
+RETRIEVE_MAX_K = 50
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedder (hashing trick over unigrams and bigrams); works offline."""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text_ in enumerate(texts):
+            tokens = re.findall(r"\w+", text_.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(out[row], hashes % self.dim, signs)
+        out = np.sign(out) * np.log1p(np.abs(out))  # damp repeated terms
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1, norms)
+
+embedder = HashingEmbedder()  # anything with .dim and .embed(texts) -> (n, dim) unit vectors
+
+def content_fingerprint(sha256: Optional[str]) -> int:
+    return int(sha256[:15], 16) if sha256 else 0  # 60 bits, fits an int64
+
+class VectorIndex:
+    def __init__(self, set_id: int, dim: int):
+        self.dim = dim
+        self.vec_path = os.path.join(VECTOR_DIR, f"{set_id}.f32")
+        self.ids_path = os.path.join(VECTOR_DIR, f"{set_id}.ids.npy")
+        self.lock_path = os.path.join(VECTOR_DIR, f"{set_id}.lock")
+        self.refresh()
+
+    def refresh(self):
+        """(Re)load the ids from disk, picking up what other processes have saved."""
+        keys = np.load(self.ids_path) if os.path.exists(self.ids_path) else np.zeros((2, 0), dtype=np.int64)
+        if keys.ndim != 2 or (keys.shape[1] and (
+            not os.path.exists(self.vec_path) or os.path.getsize(self.vec_path) < keys.shape[1] * self.dim * 4
+        )):
+            keys = np.zeros((2, 0), dtype=np.int64)  # older format, another dim or truncated: rebuild
+        self.ids, self.fingerprints = keys
+        self.reopen()
+
+    def reopen(self):
+        if self.ids.size:
+            self.matrix = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(self.ids.size, self.dim))
+        else:
+            self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+
+    def lock(self):
+        """Exclusive lock on the set's files, shared with other worker processes; returns the handle to close."""
+        os.makedirs(VECTOR_DIR, exist_ok=True)
+        handle = open(self.lock_path, "a")
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def snapshot(self) -> "VectorIndex":
+        # ids and matrix are always replaced, never changed in place, so a
+        # shallow copy stays consistent while the index keeps changing
+        return copy.copy(self)
+
+    def keys(self) -> Set[Tuple[int, int]]:
+        live = self.ids >= 0
+        return set(zip(self.ids[live].tolist(), self.fingerprints[live].tolist()))
+
+    def stamp(self) -> Dict[int, Tuple[int, int]]:
+        """(chunk count, max chunk id) per file fingerprint, over live rows."""
+        live = self.ids >= 0
+        stamp = {}
+        for fingerprint in np.unique(self.fingerprints[live]).tolist():
+            rows = self.ids[live & (self.fingerprints == fingerprint)]
+            stamp[fingerprint] = (int(rows.size), int(rows.max()))
+        return stamp
+
+    def save_ids(self):
+        tmp_path = self.ids_path + ".tmp.npy"
+        np.save(tmp_path, np.stack([self.ids, self.fingerprints]))
+        os.replace(tmp_path, self.ids_path)
+
+    # add and remove must run under lock() after refresh(), so self.ids matches the files
+    def add(self, keys: List[Tuple[int, int]], vectors: np.ndarray):
+        os.makedirs(VECTOR_DIR, exist_ok=True)
+        with open(self.vec_path, "ab") as f:
+            f.truncate(self.ids.size * self.dim * 4)  # drop rows from an interrupted add
+            f.write(vectors.astype(np.float32).tobytes())
+        chunk_ids, fingerprints = np.asarray(keys, dtype=np.int64).reshape(-1, 2).T
+        self.ids = np.concatenate([self.ids, chunk_ids])
+        self.fingerprints = np.concatenate([self.fingerprints, fingerprints])
+        self.save_ids()
+        self.reopen()
+
+    def remove(self, keys: List[Tuple[int, int]]):
+        chunk_ids, fingerprints = np.asarray(keys, dtype=np.int64).reshape(-1, 2).T
+        dead = np.zeros(self.ids.size, dtype=bool)
+        for fingerprint in np.unique(fingerprints).tolist():
+            dead |= (self.fingerprints == fingerprint) & np.isin(self.ids, chunk_ids[fingerprints == fingerprint])
+        ids, fingerprints = np.where(dead, -1, self.ids), self.fingerprints  # tombstone
+        if (ids < 0).sum() * 2 > ids.size:
+            live = ids >= 0
+            tmp_path = self.vec_path + ".tmp"
+            np.asarray(self.matrix[live]).tofile(tmp_path)
+            os.replace(tmp_path, self.vec_path)
+            ids, fingerprints = ids[live], fingerprints[live]
+        self.ids, self.fingerprints = ids, fingerprints
+        self.save_ids()
+        self.reopen()
+
+    def search(self, queries: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        """Top-k cosine matches for each query row, scored block by block."""
+        if not self.ids.size:
+            return [[] for _ in range(len(queries))]
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, self.ids.size, VECTOR_SEARCH_BLOCK):
+            block = np.asarray(self.matrix[start:start + VECTOR_SEARCH_BLOCK])
+            scores = queries @ block.T
+            scores[:, self.ids[start:start + VECTOR_SEARCH_BLOCK] < 0] = -np.inf
+            rows = np.broadcast_to(np.arange(start, start + block.shape[0]), scores.shape)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        results = []
+        for scores, rows in zip(best_scores, best_rows):
+            order = np.argsort(-scores)
+            results.append([(int(self.ids[rows[i]]), float(scores[i])) for i in order if np.isfinite(scores[i])])
+        return results
+
+vector_indexes: "OrderedDict[int, VectorIndex]" = OrderedDict()
+vector_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+async def sync_vector_index(set_id: int) -> VectorIndex:
+    """Bring the set's index up to date; returns a snapshot that is safe to search without the lock."""
+    async with vector_locks[set_id]:
+        index = vector_indexes.pop(set_id, None)
+        if index is None or index.dim != embedder.dim:
+            index = await run_in_threadpool(VectorIndex, set_id, embedder.dim)
+        vector_indexes[set_id] = index
+        while len(vector_indexes) > VECTOR_CACHE_SETS:
+            vector_indexes.popitem(last=False)
+
+        set_chunks = (
+            select(FileChunk.id, StudyFile.sha256)
+            .join(StudyFile, StudyFile.id == FileChunk.study_file_id)
+            .where(StudyFile.study_set_id == set_id)
+        )
+        async with async_session() as session:
+            stamp = {}
+            for sha256, count, max_id in (await session.execute(
+                select(StudyFile.sha256, func.count(FileChunk.id), func.max(FileChunk.id))
+                .join(StudyFile, StudyFile.id == FileChunk.study_file_id)
+                .where(StudyFile.study_set_id == set_id)
+                .group_by(StudyFile.sha256)
+            )).all():
+                count_, max_ = stamp.get(content_fingerprint(sha256), (0, 0))
+                stamp[content_fingerprint(sha256)] = (count_ + count, max(max_, max_id))
+            if index.stamp() == stamp:
+                return index.snapshot()
+            # other worker processes write the same files: hold the file lock and
+            # reload what they saved before diffing against the database
+            handle = await run_in_threadpool(index.lock)
+            try:
+                await run_in_threadpool(index.refresh)
+                if index.stamp() == stamp:
+                    return index.snapshot()
+                db_keys = {(chunk_id, content_fingerprint(sha256)) for chunk_id, sha256 in (await session.execute(set_chunks)).all()}
+                indexed = index.keys()
+                removed = list(indexed - db_keys)
+                missing = dict(sorted(db_keys - indexed))
+                rows = []
+                chunk_ids = list(missing)
+                for start in range(0, len(chunk_ids), 500):
+                    rows += (await session.exec(
+                        select(FileChunk.id, FileChunk.content).where(FileChunk.id.in_(chunk_ids[start:start + 500]))
+                    )).all()
+                if removed:  # before the add: a reused id can be in both lists
+                    await run_in_threadpool(index.remove, removed)
+                if rows:
+                    vectors = await run_in_threadpool(embedder.embed, [content for _, content in rows])
+                    await run_in_threadpool(index.add, [(chunk_id, missing[chunk_id]) for chunk_id, _ in rows], vectors)
+                return index.snapshot()
+            finally:
+                handle.close()  # releases the flock
+
+async def retrieve_passages(set_id: int, queries: List[str], k: int) -> List[List[dict]]:
+    index = await sync_vector_index(set_id)  # a snapshot: later syncs don't change what this searches
+    query_vectors = await run_in_threadpool(embedder.embed, queries)
+    matches = await run_in_threadpool(index.search, query_vectors, k)
+    chunk_ids = {chunk_id for hits in matches for chunk_id, _ in hits}
+    if not chunk_ids:
+        return [[] for _ in queries]
+    async with async_session() as session:
+        rows = (await session.execute(
+            select(FileChunk, StudyFile.file_name)
+            .join(StudyFile, StudyFile.id == FileChunk.study_file_id)
+            .where(FileChunk.id.in_(chunk_ids))
+        )).all()
+    chunks = {chunk.id: (chunk, file_name) for chunk, file_name in rows}
+    return [
+        [
+            {
+                "chunk_id": chunk_id,
+                "study_file_id": chunks[chunk_id][0].study_file_id,
+                "file_name": chunks[chunk_id][1],
+                "page_start": chunks[chunk_id][0].page_start,
+                "page_end": chunks[chunk_id][0].page_end,
+                "score": round(score, 4),
+                "content": chunks[chunk_id][0].content,
+            }
+            for chunk_id, score in hits if chunk_id in chunks
+        ]
+        for hits in matches
+    ]
+
+@app.get("/studysets/{set_id}/retrieve")
+async def retrieve(set_id: int, q: str = Query(..., min_length=1), k: int = 5):
+    async with async_session() as session:
+        if not await session.get(StudySet, set_id):
+            raise HTTPException(status_code=404, detail="StudySet not found")
+    k = max(1, min(k, RETRIEVE_MAX_K))
+    return {"results": (await retrieve_passages(set_id, [q], k))[0]}
+
+# Upload serving
+# Content-hashed blobs never change, so they are cached for a year; legacy
+# uploads/<original name> files get a content ETag and must be revalidated.
+UPLOAD_VARIANT_DIR = os.getenv("UPLOAD_VARIANT_DIR", "uploads_variants")
+CONTENT_HASH_NAME = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$")
+TEXT_LIKE_TYPES = {"application/json", "application/javascript", "application/xml", "image/svg+xml"}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+@lru_cache(maxsize=1024)
+def file_digest(path: str, mtime_ns: int, size: int) -> str:
+    # mtime and size are part of the cache key so an overwritten file is rehashed
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_text_like(media_type: str) -> bool:
+    return media_type.startswith("text/") or media_type in TEXT_LIKE_TYPES
+
+def pick_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def precompressed_variant(path: str, sha256: str, encoding: str) -> str:
+    # variants are keyed by content hash and built once, on first request
+    variant_path = os.path.join(UPLOAD_VARIANT_DIR, f"{sha256}.{'br' if encoding == 'br' else 'gz'}")
+    if os.path.exists(variant_path):
+        return variant_path
+    with open(path, "rb") as f:
+        data = f.read()
+    compressed = brotli.compress(data) if encoding == "br" else gzip.compress(data, mtime=0)
+    os.makedirs(UPLOAD_VARIANT_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_VARIANT_DIR)
+    with os.fdopen(fd, "wb") as out:
+        out.write(compressed)
+    os.replace(tmp_path, variant_path)
+    return variant_path
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+@app.api_route("/uploads/{file_path:path}", methods=["GET", "HEAD"])
+async def serve_upload(request: Request, file_path: str):
+    root = os.path.realpath(UPLOAD_DIR)
+    path = os.path.realpath(os.path.join(root, file_path))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    name = os.path.basename(path)
+    match = CONTENT_HASH_NAME.match(name)
+    if match:
+        sha256 = match.group(1)
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        stat_result = os.stat(path)
+        sha256 = await run_in_threadpool(file_digest, path, stat_result.st_mtime_ns, stat_result.st_size)
+        cache_control = REVALIDATE_CACHE_CONTROL
+
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    encoding = None
+    if is_text_like(media_type) and "range" not in request.headers:
+        # ranges are only served from the identity encoding
+        encoding = pick_encoding(request.headers.get("accept-encoding", ""))
+    etag = f'"{sha256}-{encoding}"' if encoding else f'"{sha256}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        variant_path = await run_in_threadpool(precompressed_variant, path, sha256, encoding)
+        return FileResponse(variant_path, media_type=media_type, headers=headers)
+    # FileResponse handles Range/If-Range itself and keeps our ETag
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+# Garbage collection
+# Rows whose parent is gone (left by deletes that predate the foreign keys, or by
+# SQLite tables created without them) are removed in batches, children first.
+# Upload blobs are shared by every Resume/StudyFile row with the same content,
+# so a blob is reclaimed only once nothing references it. Compressed variants,
+# stale partial uploads and vector indexes of deleted sets go the same way.
+# Files younger than GC_GRACE_SECONDS are never touched, which covers uploads
+# whose row has not been committed yet. Only content-addressed blobs are
+# collected from uploads/: files under their original name predate content
+# addressing (some ship with the repo) and are left alone unless
+# GC_LEGACY_UPLOADS=1.
+GC_INTERVAL_SECONDS = float(os.getenv("GC_INTERVAL_SECONDS", "3600"))  # 0 disables the background job
+GC_GRACE_SECONDS = float(os.getenv("GC_GRACE_SECONDS", "3600"))
+GC_BATCH_ROWS = 1000
+GC_LEGACY_UPLOADS = os.getenv("GC_LEGACY_UPLOADS", "0") == "1"
+UPLOAD_SESSION_TTL_SECONDS = float(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+gc_lock = asyncio.Lock()
+gc_tasks: List[asyncio.Task] = []
+
+def live_keys(table, column):
+    # values of `column` in rows whose whole foreign-key chain still exists
+    query = select(column)
+    for fk in table.foreign_keys:
+        query = query.where(fk.parent.in_(live_keys(fk.column.table, fk.column)))
+    return query
+
+def orphan_keys(table):
+    pk = list(table.primary_key.columns)[0]
+    return select(pk).where(or_(*(fk.parent.not_in(live_keys(fk.column.table, fk.column)) for fk in table.foreign_keys)))
+
+def old_files(directory: str, cutoff: float) -> List[Tuple[str, int]]:
+    if not os.path.isdir(directory):
+        return []
+    return [
+        (entry.path, entry.stat().st_size)
+        for entry in os.scandir(directory)
+        if entry.is_file() and entry.stat().st_mtime < cutoff
+    ]
+
+def remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def remove_blobs(paths: List[str], cutoff: float):
+    # move_to_blob touches a blob it dedupes against; rename first, then re-check
+    # the mtime, so a blob reused during the sweep is put back instead of deleted
+    for path in paths:
+        doomed = f"{path}.gc"
+        try:
+            os.replace(path, doomed)
+        except FileNotFoundError:
+            continue
+        if os.stat(doomed).st_mtime < cutoff:
+            os.remove(doomed)
+        else:
+            os.replace(doomed, path)
+
+def vector_set_ids() -> Set[int]:
+    names = os.listdir(VECTOR_DIR) if os.path.isdir(VECTOR_DIR) else []
+    return {int(name.split(".")[0]) for name in names if name.split(".")[0].isdigit()}
+
+def scan_files(referenced_urls: Set[str], live_sets: Set[int], cutoff: float) -> Dict[str, list]:
+    """Unreferenced files older than `cutoff`, grouped by kind as (path, size) pairs."""
+    found: Dict[str, list] = {"uploads": [], "variants": [], "partial_uploads": [], "vectors": []}
+    kept_hashes = set()
+    for entry in os.scandir(UPLOAD_DIR) if os.path.isdir(UPLOAD_DIR) else []:
+        if not entry.is_file() or entry.name.endswith(".gc"):
+            continue
+        stat_result = entry.stat()
+        match = CONTENT_HASH_NAME.match(entry.name)
+        collectable = match is not None or GC_LEGACY_UPLOADS
+        if not collectable or f"/uploads/{entry.name}" in referenced_urls or stat_result.st_mtime >= cutoff:
+            kept_hashes.add(match.group(1) if match else file_digest(entry.path, stat_result.st_mtime_ns, stat_result.st_size))
+        else:
+            found["uploads"].append((entry.path, stat_result.st_size))
+    for path, size in old_files(UPLOAD_VARIANT_DIR, cutoff):
+        if os.path.basename(path).split(".")[0] not in kept_hashes:
+            found["variants"].append((path, size))
+    found["partial_uploads"] = old_files(UPLOAD_PARTIAL_DIR, cutoff)  # callers drop files of live sessions
+    vector_files = [(path, size, os.path.basename(path).split(".")[0]) for path, size in old_files(VECTOR_DIR, cutoff)]
+    found["vectors"] = [(path, size) for path, size, set_id in vector_files if not set_id.isdigit() or int(set_id) not in live_sets]
+    return found
+
+async def collect_garbage(dry_run: bool = False) -> dict:
+    """Remove (or with dry_run, only count) orphaned rows and unreferenced files."""
+    async with gc_lock:
+        now = datetime.utcnow()
+        cutoff = time.time() - GC_GRACE_SECONDS
+        rows: Dict[str, int] = {}
+        async with async_session() as session:
+            for table in reversed(SQLModel.metadata.sorted_tables):
+                if not table.foreign_keys:
+                    continue
+                if dry_run:
+                    rows[table.name] = (await session.execute(
+                        select(func.count()).select_from(orphan_keys(table).subquery())
+                    )).scalar_one()
+                    continue
+                rows[table.name] = 0
+                pk = list(table.primary_key.columns)[0]
+                while batch := (await session.execute(orphan_keys(table).limit(GC_BATCH_ROWS))).scalars().all():
+                    await session.execute(delete(table).where(pk.in_(batch)))
+                    await session.commit()
+                    rows[table.name] += len(batch)
+
+            stale_uploads = (await session.exec(
+                select(UploadSession.id).where(UploadSession.created_at < now - timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS))
+            )).all()
+            rows[UploadSession.__tablename__] = len(stale_uploads)
+            if stale_uploads and not dry_run:
+                await session.execute(delete(UploadSession).where(UploadSession.id.in_(stale_uploads)))
+                await session.commit()
+
+            # reference counts per blob; in a dry run, rows about to be removed do not count
+            live_files = StudyFile.id.in_(live_keys(StudyFile.__table__, StudyFile.__table__.c.id))
+            ref_counts: Dict[str, int] = defaultdict(int)
+            for query in (
+                select(Resume.file_url, func.count()).group_by(Resume.file_url),
+                select(StudyFile.file_url, func.count()).where(live_files).group_by(StudyFile.file_url),
+            ):
+                for file_url, count in (await session.execute(query)).all():
+                    ref_counts[file_url] += count
+            live_uploads = set((await session.exec(select(UploadSession.id))).all()) - set(stale_uploads)
+            indexed_sets = await run_in_threadpool(vector_set_ids)
+            live_sets = set((await session.exec(select(StudySet.id).where(StudySet.id.in_(indexed_sets)))).all()) if indexed_sets else set()
+
+        found = await run_in_threadpool(scan_files, set(ref_counts), live_sets, cutoff)
+        found["partial_uploads"] = [(p, n) for p, n in found["partial_uploads"] if os.path.basename(p) not in live_uploads]
+        if not dry_run:
+            await run_in_threadpool(remove_blobs, [path for path, _ in found["uploads"]], cutoff)
+            await run_in_threadpool(remove_files, [path for kind in ("variants", "partial_uploads", "vectors") for path, _ in found[kind]])
+            for path, _ in found["vectors"]:
+                set_id = os.path.basename(path).split(".")[0]
+                if set_id.isdigit():
+                    vector_indexes.pop(int(set_id), None)
+
+        files = {kind: {"count": len(items), "bytes": sum(size for _, size in items)} for kind, items in found.items()}
+        return {
+            "dry_run": dry_run,
+            "rows": rows,
+            "files": files,
+            "referenced_blobs": len(ref_counts),
+            "shared_blobs": sum(1 for count in ref_counts.values() if count > 1),
+            "bytes": sum(kind["bytes"] for kind in files.values()),
+        }
+
+@app.get("/maintenance/gc")
+async def gc_report():
+    # dry run: what a collection would reclaim right now
+    return await collect_garbage(dry_run=True)
+
+@app.post("/maintenance/gc")
+async def run_gc():
+    return await collect_garbage()
+
+async def gc_loop():
+    while True:
+        await asyncio.sleep(GC_INTERVAL_SECONDS)
+        try:
+            report = await collect_garbage()
+            logging.getLogger(__name__).info("GC reclaimed %s bytes, rows %s", report["bytes"], report["rows"])
+        except Exception:
+            logging.getLogger(__name__).exception("GC failed")
+
+@app.on_event("startup")
+async def start_gc():
+    if GC_INTERVAL_SECONDS > 0:
+        gc_tasks.append(asyncio.create_task(gc_loop()))
 
+@app.on_event("shutdown")
+async def stop_gc():
+    for task in gc_tasks:
+        task.cancel()
+    await asyncio.gather(*gc_tasks, return_exceptions=True)
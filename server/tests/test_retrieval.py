@@ -0,0 +1,62 @@
+"""Regression tests for the per-set vector index.
+
+Run from the server directory:
+
+    python -m pytest -q tests
+"""
+import asyncio
+import inspect
+import os
+import sys
+import tempfile
+
+WORKDIR = tempfile.mkdtemp(prefix="lessin-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'test.db')}"
+os.environ["EXTRACT_WORKERS"] = "0"
+os.environ["GC_INTERVAL_SECONDS"] = "0"
+os.chdir(WORKDIR)  # uploads/, vectors/ etc. are relative to the working directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+
+
+async def run_handlers(handlers):
+    for handler in handlers:
+        result = handler()
+        if inspect.isawaitable(result):
+            await result
+
+
+async def upload(client, set_id: int, name: str, text: str) -> int:
+    response = await client.post("/studyfiles", data={"study_set_id": set_id}, files={"file": (name, text.encode())})
+    assert response.status_code == 200, response.text
+    while (job_id := await main.claim_extraction_job()) is not None:
+        await main.run_extraction_job(job_id)
+    return response.json()["id"]
+
+
+def test_reused_chunk_ids_are_reindexed():
+    # SQLite reuses the ids of the newest deleted rows, so c.txt's chunk gets b.txt's old id
+    async def scenario():
+        await run_handlers(main.app.router.on_startup)
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                set_id = (await client.post("/studysets", data={"user_id": 1, "title": "history"})).json()["id"]
+                await upload(client, set_id, "a.txt", "the french revolution began in paris")
+                b_id = await upload(client, set_id, "b.txt", "napoleon stormed the bastille")
+                assert (await client.get(f"/studysets/{set_id}/retrieve", params={"q": "napoleon bastille"})).json()["results"]
+
+                assert (await client.delete(f"/studyfiles/{b_id}")).status_code == 200
+                await upload(client, set_id, "c.txt", "matrix eigenvalue decomposition")
+
+                stale = (await client.get(f"/studysets/{set_id}/retrieve", params={"q": "napoleon bastille"})).json()["results"]
+                fresh = (await client.get(f"/studysets/{set_id}/retrieve", params={"q": "eigenvalue"})).json()["results"]
+        finally:
+            await run_handlers(main.app.router.on_shutdown)
+        assert all(hit["score"] == 0 for hit in stale if hit["file_name"] == "c.txt")
+        assert fresh[0]["file_name"] == "c.txt" and fresh[0]["score"] > 0
+
+    asyncio.run(scenario())